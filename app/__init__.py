@@ -10,6 +10,9 @@ db = SQLAlchemy()
 login_manager = LoginManager()
 login_manager.login_view = 'admin.login'
 
+# The application instance shared by run.py, wsgi.py and the scripts
+_app = None
+
 @login_manager.user_loader
 def load_user(user_id):
     from app.models import Admin
@@ -22,7 +25,7 @@ def create_app():
     db.init_app(app)
     login_manager.init_app(app)
     
-    from app.models import Admin, Note, Major, Semester, Lesson, Teacher, Rating, Subscription, User
+    from app.models import Admin, Note, Major, Semester, Lesson, Teacher, Rating, Subscription, User, BroadcastJob, PendingNotification, NoteDownloadStat, AnalyticsRollup, AnalyticsWatermark, NotePage, LessonBundle, CatalogChange
     
     from app.admin import bp as admin_bp
     app.register_blueprint(admin_bp)
@@ -33,6 +36,19 @@ def create_app():
     from app.routes import main as main_bp
     app.register_blueprint(main_bp)
     
+    from app.utils import changes
+    from app.admin import broadcast
+    
+    @app.before_request
+    def catch_up_on_catalog_changes():
+        # Sync workers have no background loop, so requests poll the change feed
+        changes.feed.poll_if_due(app.config['CHANGE_POLL_SECONDS'])
+    
+    @app.before_request
+    def resume_stale_broadcasts():
+        # Broadcasts run in web processes; one cut off by a restart is picked up by the next that looks
+        broadcast.resume_stale_jobs_if_due(app)
+    
     @app.template_filter('jalali_date')
     def jalali_date(value):
         if value is None:
@@ -41,4 +57,15 @@ def create_app():
     
     return app
 
-app = create_app()
\ No newline at end of file
+def get_app():
+    """Return the shared application, creating it on first use."""
+    global _app
+    if _app is None:
+        _app = create_app()
+    return _app
+
+def __getattr__(name):
+    # Keep `from app import app` working without building the app at import time
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,119 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def bot_api_options():
+    """Keyword arguments that point a Bot at the configured Bot API server."""
+    if not Config.TELEGRAM_API_URL:
+        return {}
+    return {
+        'base_url': Config.TELEGRAM_API_URL,
+        'base_file_url': Config.TELEGRAM_API_FILE_URL,
+        'local_mode': Config.TELEGRAM_LOCAL_MODE
+    }
+
+class BotClient:
+    """One long-lived Telegram Bot per process, running on its own event loop thread.
+
+    Admin requests and background workers hand coroutines to run() or
+    submit() from any thread. The HTTP connection pool, TLS sessions and
+    the bot's identity from get_me() are reused across calls. The loop is
+    started on first use and again after a fork, so every worker process
+    gets its own. Under asgi.py the client is attached to the server's loop
+    and bot instead, so admin sends share the bot's connections.
+    """
+
+    def __init__(self, token, pool_size):
+        self.token = token
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._bot = None
+        self._owned = False
+
+    def _start(self):
+        # Imported lazily so pure admin requests never pay for python-telegram-bot
+        from telegram.ext import ExtBot
+        from telegram.request import HTTPXRequest
+        from ..utils.rate_limit import get_scheduler
+
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name='telegram-client', daemon=True).start()
+        bot = ExtBot(
+            token=self.token,
+            request=HTTPXRequest(connection_pool_size=self.pool_size, pool_timeout=30),
+            rate_limiter=get_scheduler(),
+            **bot_api_options()
+        )
+        # initialize() calls get_me() once and caches the result on the bot
+        asyncio.run_coroutine_threadsafe(bot.initialize(), loop).result()
+        self._loop, self._bot, self._pid, self._owned = loop, bot, os.getpid(), True
+
+    def attach(self, loop, bot):
+        """Send through an initialized `bot` on a `loop` owned by someone else, e.g. the ASGI server.
+
+        Callers must not block on run() from the loop's own thread.
+        """
+        with self._lock:
+            if self._owned and self._pid == os.getpid():
+                self.close()
+            self._loop, self._bot, self._pid, self._owned = loop, bot, os.getpid(), False
+
+    def detach(self):
+        """Stop using an attached loop; the next call starts a private one again."""
+        with self._lock:
+            if not self._owned:
+                self._loop, self._bot, self._pid = None, None, None
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start()
+
+    @property
+    def bot(self):
+        self._ensure_started()
+        return self._bot
+
+    @property
+    def username(self):
+        return self.bot.username
+
+    def submit(self, coroutine):
+        """Schedule `coroutine` on the client loop and return a concurrent.futures.Future."""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def run(self, coroutine, timeout=None):
+        """Run `coroutine` on the client loop and wait for its result."""
+        return self.submit(coroutine).result(timeout)
+
+    def close(self):
+        if self._pid != os.getpid() or not self._owned:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._bot.shutdown(), self._loop).result(10)
+        except Exception as e:
+            logger.error(f"Error closing Telegram client: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._pid = None
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide Telegram client."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = BotClient(Config.TELEGRAM_TOKEN, Config.TELEGRAM_POOL_SIZE)
+            atexit.register(_client.close)
+        return _client
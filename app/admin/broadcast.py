@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, or_
+
+from ..models.database import db, User, BroadcastJob
+from ..utils import subscriptions
+from .bot_client import get_client
+
+logger = logging.getLogger(__name__)
+
+AUDIENCES = ('all', 'active', 'lesson', 'not_blocked', 'selected')
+
+# A single worker keeps broadcasts from competing with each other for the rate limit
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='broadcast')
+
+# How often a process looks for jobs another process stopped sending
+STALE_CHECK_SECONDS = 60
+_stale_checked_at = None
+_stale_lock = threading.Lock()
+
+def audience_query(audience, value=None):
+    """Build a SELECT of recipient telegram ids for an audience definition."""
+    query = select(User.telegram_id).where(User.telegram_id.isnot(None))
+
+    if audience == 'all':
+        pass
+    elif audience == 'active':
+        since = datetime.utcnow() - timedelta(days=int(value))
+        query = query.where(User.last_active >= since)
+    elif audience == 'lesson':
+        # Subscribers of the lesson's semester or major hear about it too
+        covering = subscriptions.lesson_recipients(int(value)).subquery()
+        query = query.where(User.id.in_(select(covering.c.user_id)))
+    elif audience == 'not_blocked':
+        query = query.where(or_(User.is_blocked.is_(False), User.is_blocked.is_(None)))
+    elif audience == 'selected':
+        user_ids = [int(user_id) for user_id in (value or '').split(',') if user_id]
+        query = query.where(User.id.in_(user_ids))
+    else:
+        raise ValueError(f"Unknown audience: {audience}")
+
+    return query
+
+def iter_audience(query, batch_size, after=None):
+    """Yield lists of telegram ids above `after`, one keyset-ordered batch at a time.
+
+    Each batch is a short indexed range scan on the unique telegram_id, so
+    the whole audience is never held in memory and no read transaction stays
+    open between batches (SQLite would otherwise block progress commits).
+    """
+    last_telegram_id = after
+    while True:
+        batch_query = query.order_by(User.telegram_id).limit(batch_size)
+        if last_telegram_id is not None:
+            batch_query = batch_query.where(User.telegram_id > last_telegram_id)
+
+        telegram_ids = db.session.execute(
+            batch_query.execution_options(stream_results=True, yield_per=batch_size)
+        ).scalars().all()
+        db.session.commit()  # Release the read transaction before sending
+
+        if not telegram_ids:
+            return
+        yield telegram_ids
+        last_telegram_id = telegram_ids[-1]
+
+def create_job(message, audience, value=None):
+    """Persist a new broadcast job with its audience size."""
+    query = audience_query(audience, value)
+    total = db.session.execute(
+        select(func.count()).select_from(query.subquery())
+    ).scalar()
+
+    job = BroadcastJob(
+        message=message,
+        audience=audience,
+        audience_value=str(value) if value is not None else None,
+        status='pending',
+        total=total,
+        sent=0,
+        failed=0
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def _save_progress(job):
+    job.heartbeat = datetime.utcnow()
+    db.session.commit()
+
+def _stale_cutoff(app):
+    return datetime.utcnow() - timedelta(minutes=app.config['BROADCAST_STALE_MINUTES'])
+
+def _silent_since():
+    # Jobs left running before heartbeats existed count from their creation
+    return func.coalesce(BroadcastJob.heartbeat, BroadcastJob.created_at)
+
+def _claim(app, job_id):
+    """Mark a job running for this process unless another process is sending it; returns whether it did."""
+    claimed = BroadcastJob.query.filter(
+        BroadcastJob.id == job_id,
+        or_(
+            BroadcastJob.status == 'pending',
+            (BroadcastJob.status == 'running') & (_silent_since() < _stale_cutoff(app))
+        )
+    ).update({'status': 'running', 'heartbeat': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return bool(claimed)
+
+def run_job(app, job_id):
+    """Send a broadcast job to its audience, or the rest of it when resumed.
+
+    Counts and the audience cursor are committed together every
+    BROADCAST_PROGRESS_SECONDS, so the progress endpoint moves while a
+    rate-limited batch is still sending. The same commit is the job's
+    heartbeat; see `resume_stale_jobs`.
+    """
+    with app.app_context():
+        if not _claim(app, job_id):
+            return
+        job = BroadcastJob.query.get(job_id)
+
+        batch_size = app.config['BROADCAST_BATCH_SIZE']
+        progress_seconds = app.config['BROADCAST_PROGRESS_SECONDS']
+        try:
+            from ..utils.rate_limit import BULK_ARGS
+
+            client = get_client()
+            saved_at = time.monotonic()
+
+            query = audience_query(job.audience, job.audience_value)
+            for telegram_ids in iter_audience(query, batch_size, after=job.last_telegram_id):
+                for telegram_id in telegram_ids:
+                    try:
+                        # The outbound scheduler paces bulk sends and absorbs RetryAfter
+                        client.run(client.bot.send_message(
+                            chat_id=telegram_id, text=job.message,
+                            parse_mode='Markdown', rate_limit_args=BULK_ARGS
+                        ))
+                        job.sent += 1
+                    except Exception as e:
+                        logger.error(f"Error sending broadcast {job_id} to user {telegram_id}: {e}")
+                        job.failed += 1
+                    job.last_telegram_id = telegram_id
+                    if time.monotonic() - saved_at >= progress_seconds:
+                        _save_progress(job)
+                        saved_at = time.monotonic()
+                _save_progress(job)
+                saved_at = time.monotonic()
+
+            # Users removed since the job was created are no longer pending
+            job.total = job.sent + job.failed
+            job.status = 'done'
+        except Exception as e:
+            logger.error(f"Broadcast {job_id} failed: {e}")
+            db.session.rollback()
+            job.status = 'failed'
+        finally:
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+def start_job(app, job):
+    """Queue a job on the background broadcast worker."""
+    _executor.submit(run_job, app, job.id)
+
+def resume_stale_jobs(app):
+    """Queue the jobs a dead process left unfinished, e.g. cut off by a restart; requires an app context.
+
+    That is a running job with no heartbeat for BROADCAST_STALE_MINUTES,
+    or a job still pending that long. run_job() claims a job with a
+    conditional UPDATE, so only one process sends it. A resumed job
+    continues after its saved cursor; at most the sends since its last
+    progress commit are repeated.
+    """
+    cutoff = _stale_cutoff(app)
+    job_ids = db.session.execute(
+        select(BroadcastJob.id).where(or_(
+            (BroadcastJob.status == 'running') & (_silent_since() < cutoff),
+            (BroadcastJob.status == 'pending') & (BroadcastJob.created_at < cutoff)
+        ))
+    ).scalars().all()
+    db.session.commit()
+    for job_id in job_ids:
+        logger.warning(f"Resuming broadcast {job_id}")
+        _executor.submit(run_job, app, job_id)
+    return len(job_ids)
+
+def resume_stale_jobs_if_due(app):
+    """resume_stale_jobs() unless this process already looked within STALE_CHECK_SECONDS."""
+    global _stale_checked_at
+    with _stale_lock:
+        now = time.monotonic()
+        if _stale_checked_at is not None and now - _stale_checked_at < STALE_CHECK_SECONDS:
+            return
+        _stale_checked_at = now
+    resume_stale_jobs(app)
@@ -0,0 +1,69 @@
+import hashlib
+import os
+from urllib.parse import quote
+
+from flask import current_app, request, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import send_file as send_file_via_header
+
+from ..models.database import db
+
+HASH_BUFFER = 1024 * 1024
+
+def content_hash(note):
+    """SHA-256 of a note's original file, hashed on first use and kept until the file is replaced."""
+    if not note.content_hash:
+        digest = hashlib.sha256()
+        with open(note.file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_BUFFER), b''):
+                digest.update(chunk)
+        note.content_hash = digest.hexdigest()
+        db.session.commit()
+    return note.content_hash
+
+def _accel_location(path):
+    # The nginx internal location that maps onto UPLOAD_FOLDER, or None to send the file ourselves
+    prefix = current_app.config['NOTE_ACCEL_PREFIX']
+    if not prefix:
+        return None
+    relative = os.path.relpath(os.path.realpath(path), os.path.realpath(current_app.config['UPLOAD_FOLDER']))
+    if relative.startswith(os.pardir):
+        return None
+    return prefix.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+
+def send_note(note, as_attachment=False):
+    """Response with a note's original PDF for the admin panel.
+
+    The ETag is the file's content hash, so conditional requests answer
+    304 without touching the file. With NOTE_ACCEL_PREFIX set, nginx is
+    told to serve the file itself through X-Accel-Redirect and handles
+    Range there. Otherwise Werkzeug answers Range and If-Range, and the
+    body goes through the server's wsgi.file_wrapper, which gunicorn
+    sends with sendfile().
+    """
+    if not os.path.exists(note.file_path):
+        raise NotFound()
+    options = dict(
+        mimetype='application/pdf',
+        as_attachment=as_attachment,
+        download_name=f"{note.name.replace('/', '-')}.pdf",
+        etag=content_hash(note)
+    )
+
+    location = _accel_location(note.file_path)
+    if location:
+        # Werkzeug builds the headers without opening the file; nginx serves the bytes and ranges
+        response = send_file_via_header(
+            note.file_path, request.environ, use_x_sendfile=True, conditional=False, **options
+        )
+        del response.headers['X-Sendfile']
+        response.content_length = 0
+        response = response.make_conditional(request.environ)
+        if response.status_code != 304:
+            # nginx would answer a 304 with the file too
+            response.headers['X-Accel-Redirect'] = location
+    else:
+        response = send_file(note.file_path, conditional=True, **options)
+    # Behind a login, so shared caches must not keep it
+    response.cache_control.private = True
+    return response
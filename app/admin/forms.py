@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired, FileAllowed
-from wtforms import StringField, PasswordField, SubmitField, TextAreaField
+from wtforms import StringField, PasswordField, SubmitField, TextAreaField, HiddenField
 from wtforms.validators import DataRequired, Length, Optional
 
 class LoginForm(FlaskForm):
@@ -20,4 +20,6 @@ class NoteUploadForm(FlaskForm):
     file = FileField('فایل جزوه', validators=[
         FileAllowed(['pdf'], 'فقط فایل‌های PDF مجاز هستند')
     ])
+    # Set by the browser after a chunked upload; used instead of `file` when present
+    upload_id = HiddenField()
     submit = SubmitField('ذخیره') 
\ No newline at end of file
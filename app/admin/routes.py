@@ -1,24 +1,20 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify
+from flask import render_template, redirect, url_for, flash, request, jsonify, current_app, Response
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
-from ..models.database import db, Admin, Note, Major, Semester, Lesson, Teacher, User, Subscription
+from ..models.database import db, Admin, Note, Major, Semester, Lesson, Teacher, User, Subscription, BroadcastJob, PendingNotification, NoteDownloadStat
 from .forms import LoginForm, NoteUploadForm
+import asyncio
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 # import jdatetime
 from config import Config
-import asyncio
-from telegram import Bot
-import nest_asyncio
-from . import bp
+from . import bp, broadcast, files, uploads
+from .bot_client import get_client
+from ..utils import analytics, backup, blocklist, bundles, changes, digest, downloads, fulltext, metrics, pdf_optimize, ranking, subscriptions, taxonomy
 import logging
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
-
 def convert_persian_date(date_str):
     """Convert Persian date string to Gregorian datetime object."""
     if not date_str or not date_str.strip():
@@ -31,56 +27,61 @@ def convert_persian_date(date_str):
         print(f"Error converting date: {e}")
         return datetime.now().date()  # Return today's date as fallback
 
+def _taxonomy_names(form):
+    return {field: getattr(form, field).data for field in taxonomy.ORDER}
+
 def sync_notify_subscribers(bot_token, note, lesson):
-    """Synchronous wrapper for notification function."""
+    """Send the new-note notification to subscribers through the shared Telegram client."""
     try:
-        # Create new event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        from ..utils.rate_limit import BULK_ARGS
+
+        client = get_client()
+
+        # Digest-mode subscribers get this note in their next digest instead
+        covering = subscriptions.recipients(note.teacher_id).subquery()
+        subscribers = User.query.join(covering, covering.c.user_id == User.id).filter(
+            User.digest_mode.isnot(True)
+        ).all()
         
-        async def send_notifications():
-            bot = Bot(token=bot_token)
-            # Get bot info first to ensure connection
-            bot_info = await bot.get_me()
+        if not subscribers:
+            logger.info("هیچ مشترکی برای این درس یافت نشد")
+            return
             
-            subscribers = User.query.join(Subscription).filter(
-                Subscription.lesson_id == lesson.id
-            ).all()
+        notification_text = (
+            f"📢 جزوه جدید!\n\n"
+            f"*{note.name}*\n"
+            f"درس: {lesson.name}\n"
+            f"استاد: {note.teacher.name}\n"
+            f"نویسنده: {note.author}\n\n"
+            f"[📥 دانلود جزوه](https://t.me/{client.username}?start=note_{note.id})"
+        )
+        telegram_ids = [subscriber.telegram_id for subscriber in subscribers]
+        
+        async def send_notifications():
+            # At most one send per pooled connection; the outbound scheduler still paces them
+            slots = asyncio.Semaphore(client.pool_size)
             
-            if not subscribers:
-                print("هیچ مشترکی برای این درس یافت نشد")
-                return
-                
-            notification_text = (
-                f"📢 جزوه جدید!\n\n"
-                f"*{note.name}*\n"
-                f"درس: {lesson.name}\n"
-                f"استاد: {note.teacher.name}\n"
-                f"نویسنده: {note.author}\n\n"
-                f"[📥 دانلود جزوه](https://t.me/{bot_info.username}?start=note_{note.id})"
-            )
+            async def notify(telegram_id):
+                async with slots:
+                    try:
+                        await client.bot.send_message(
+                            chat_id=telegram_id,
+                            text=notification_text,
+                            parse_mode='Markdown',
+                            disable_web_page_preview=True,
+                            rate_limit_args=BULK_ARGS
+                        )
+                        logger.info(f"اعلان برای کاربر {telegram_id} ارسال شد")
+                        metrics.increment('notifications_sent')
+                    except Exception as e:
+                        logger.error(f"خطا در ارسال اعلان به کاربر {telegram_id}: {e}")
             
-            for subscriber in subscribers:
-                try:
-                    await bot.send_message(
-                        chat_id=subscriber.telegram_id,
-                        text=notification_text,
-                        parse_mode='Markdown',
-                        disable_web_page_preview=True
-                    )
-                    print(f"اعلان برای کاربر {subscriber.telegram_id} ارسال شد")
-                except Exception as e:
-                    print(f"خطا در ارسال اعلان به کاربر {subscriber.telegram_id}: {e}")
+            await asyncio.gather(*(notify(telegram_id) for telegram_id in telegram_ids))
         
-        # Run the async function in the new event loop
-        loop.run_until_complete(send_notifications())
+        # Runs on the client's loop; the upload request does not wait for the fan-out
+        client.submit(send_notifications())
     except Exception as e:
-        print(f"خطا در تابع sync_notify_subscribers: {e}")
-    finally:
-        try:
-            loop.close()
-        except:
-            pass
+        logger.error(f"خطا در تابع sync_notify_subscribers: {e}")
 
 @bp.route('/')
 @bp.route('/index')
@@ -107,7 +108,8 @@ def login():
 @login_required
 def dashboard():
     notes = Note.query.order_by(Note.upload_date.desc()).all()
-    return render_template('admin/dashboard.html', notes=notes)
+    top_notes = downloads.top_downloads(ttl=current_app.config['TOP_DOWNLOADS_CACHE_SECONDS'])
+    return render_template('admin/dashboard.html', notes=notes, top_notes=top_notes)
 
 @bp.route('/edit_note/<int:note_id>', methods=['GET', 'POST'])
 @login_required
@@ -129,6 +131,8 @@ def edit_note(note_id):
         form.teacher.data = note.teacher.name
     
     if form.validate_on_submit():
+        old_file_path = note.file_path
+        file_path = None
         try:
             # Update note details
             note.name = form.name.data
@@ -137,51 +141,45 @@ def edit_note(note_id):
             note.description = form.description.data
             
             # Handle file upload if new file is provided
-            if form.file.data:
-                # Delete old file
-                if os.path.exists(note.file_path):
-                    os.remove(note.file_path)
+            file_replaced = bool(form.upload_id.data or form.file.data)
+            if file_replaced:
+                # Save the new file under its own path, so a failed edit leaves the old one in place
+                if form.upload_id.data:
+                    file_path = uploads.finish(form.upload_id.data)
+                else:
+                    file_path = uploads.save(form.file.data)
                 
-                # Save new file
-                file = form.file.data
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(Config.UPLOAD_FOLDER, filename)
-                file.save(file_path)
+                # Forget the old file's optimized copy and indexed text
+                pdf_optimize.discard(note)
+                fulltext.discard(note)
                 note.file_path = file_path
+                note.content_hash = None
             
             # Update or create major, semester, lesson, and teacher
-            major = Major.query.filter_by(name=form.major.data).first()
-            if not major:
-                major = Major(name=form.major.data)
-                db.session.add(major)
-                db.session.flush()
-            
-            semester = Semester.query.filter_by(name=form.semester.data, major_id=major.id).first()
-            if not semester:
-                semester = Semester(name=form.semester.data, major_id=major.id)
-                db.session.add(semester)
-                db.session.flush()
-            
-            lesson = Lesson.query.filter_by(name=form.lesson.data, semester_id=semester.id).first()
-            if not lesson:
-                lesson = Lesson(name=form.lesson.data, semester_id=semester.id)
-                db.session.add(lesson)
-                db.session.flush()
-            
-            teacher = Teacher.query.filter_by(name=form.teacher.data, lesson_id=lesson.id).first()
-            if not teacher:
-                teacher = Teacher(name=form.teacher.data, lesson_id=lesson.id)
-                db.session.add(teacher)
-                db.session.flush()
+            old_lesson_id = note.teacher.lesson_id
+            teacher = taxonomy.get_or_create(_taxonomy_names(form))
             
             note.teacher_id = teacher.id
+            for lesson_id in {old_lesson_id, teacher.lesson_id}:
+                bundles.invalidate(lesson_id)
+                changes.record(changes.LESSON, lesson_id)
             db.session.commit()
+            taxonomy.index.invalidate()
+            if file_replaced:
+                # Only now is nothing left pointing at the old file
+                if os.path.exists(old_file_path):
+                    os.remove(old_file_path)
+                pdf_optimize.submit(current_app._get_current_object(), note)
+                fulltext.submit(current_app._get_current_object(), note)
             
             flash('جزوه با موفقیت به‌روزرسانی شد!', 'success')
             return redirect(url_for('admin.dashboard'))
             
         except Exception as e:
             db.session.rollback()
+            # The note still points at its old file; drop a new one saved beside it
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
             flash(f'خطا در به‌روزرسانی جزوه: {str(e)}', 'danger')
     
     return render_template('admin/upload_note.html', form=form, edit_mode=True)
@@ -199,43 +197,19 @@ def upload_note():
 
             # Handle file upload
             file = form.file.data
-            if not file:
+            if not file and not form.upload_id.data:
                 flash('فایل برای جزوه‌های جدید الزامی است.', 'danger')
                 return render_template('admin/upload_note.html', form=form, edit_mode=False)
-                
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(Config.UPLOAD_FOLDER, filename)
-            
-            # Create or get major
-            major = Major.query.filter_by(name=form.major.data).first()
-            if not major:
-                major = Major(name=form.major.data)
-                db.session.add(major)
-                db.session.flush()
-            
-            # Create or get semester
-            semester = Semester.query.filter_by(name=form.semester.data, major_id=major.id).first()
-            if not semester:
-                semester = Semester(name=form.semester.data, major_id=major.id)
-                db.session.add(semester)
-                db.session.flush()
-            
-            # Create or get lesson
-            lesson = Lesson.query.filter_by(name=form.lesson.data, semester_id=semester.id).first()
-            if not lesson:
-                lesson = Lesson(name=form.lesson.data, semester_id=semester.id)
-                db.session.add(lesson)
-                db.session.flush()
             
-            # Create or get teacher
-            teacher = Teacher.query.filter_by(name=form.teacher.data, lesson_id=lesson.id).first()
-            if not teacher:
-                teacher = Teacher(name=form.teacher.data, lesson_id=lesson.id)
-                db.session.add(teacher)
-                db.session.flush()
+            # Create or get major, semester, lesson and teacher
+            teacher = taxonomy.get_or_create(_taxonomy_names(form))
+            lesson = teacher.lesson
         
-            # Save file
-            file.save(file_path)
+            # Save file; chunked uploads are already on disk and only need moving
+            if form.upload_id.data:
+                file_path = uploads.finish(form.upload_id.data)
+            else:
+                file_path = uploads.save(file)
             
             # Create note
             note = Note(
@@ -249,18 +223,25 @@ def upload_note():
                 rating_sum=0,
                 rating_count=0
             )
+            ranking.init_note(note)
             
             db.session.add(note)
+            bundles.invalidate(teacher.lesson_id)
+            changes.record(changes.LESSON, teacher.lesson_id)
             db.session.commit()
+            taxonomy.index.invalidate()
+            pdf_optimize.submit(current_app._get_current_object(), note)
+            fulltext.submit(current_app._get_current_object(), note)
             
             # Notify subscribers
             bot_token = Config.TELEGRAM_TOKEN
             if bot_token:
                 try:
+                    digest.queue_note(note)
                     sync_notify_subscribers(bot_token, note, lesson)
-                    print("فرآیند اعلان‌رسانی تکمیل شد")
+                    logger.info("فرآیند اعلان‌رسانی آغاز شد")
                 except Exception as e:
-                    print(f"خطا در اعلان‌رسانی: {e}")
+                    logger.error(f"خطا در اعلان‌رسانی: {e}")
             
             flash('جزوه با موفقیت آپلود شد!', 'success')
             return redirect(url_for('admin.dashboard'))
@@ -271,6 +252,36 @@ def upload_note():
 
     return render_template('admin/upload_note.html', form=form, edit_mode=False)
 
+@bp.route('/uploads', methods=['POST'])
+@login_required
+def start_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify({'success': True, **uploads.start(str(data.get('filename', '')), int(data.get('size', 0)))})
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'درخواست نامعتبر است.'}), 400
+    except uploads.UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+@bp.route('/uploads/<upload_id>', methods=['GET', 'PUT'])
+@login_required
+def resume_upload(upload_id):
+    try:
+        if request.method == 'GET':
+            return jsonify({'success': True, **uploads.status(upload_id)})
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({'success': False, 'error': 'موقعیت بخش مشخص نشده است.'}), 400
+        return jsonify({'success': True, **uploads.append(upload_id, offset, request.stream)})
+    except uploads.UploadError as e:
+        return jsonify({'success': False, 'error': str(e), 'offset': e.offset}), e.status
+
+@bp.route('/notes/<int:note_id>/file')
+@login_required
+def note_file(note_id):
+    note = Note.query.get_or_404(note_id)
+    return files.send_note(note, as_attachment=request.args.get('download') == '1')
+
 @bp.route('/logout')
 @login_required
 def logout():
@@ -286,8 +297,14 @@ def delete_note(note_id):
         # Delete file
         if os.path.exists(note.file_path):
             os.remove(note.file_path)
+        pdf_optimize.discard(note)
+        fulltext.discard(note)
         
         # Delete note from database
+        bundles.invalidate(note.teacher.lesson_id)
+        changes.record(changes.LESSON, note.teacher.lesson_id)
+        PendingNotification.query.filter_by(note_id=note.id).delete()
+        NoteDownloadStat.query.filter_by(note_id=note.id).delete()
         db.session.delete(note)
         db.session.commit()
         flash('جزوه با موفقیت حذف شد!', 'success')
@@ -301,56 +318,135 @@ def delete_note(note_id):
 @login_required
 def users():
     users = User.query.order_by(User.id.desc()).all()
-    return render_template('admin/users.html', users=users)
+    lessons = Lesson.query.order_by(Lesson.name).all()
+    return render_template('admin/users.html', users=users, lessons=lessons)
+
+@bp.route('/users/<int:user_id>/block', methods=['POST'])
+@login_required
+def block_user(user_id):
+    user = User.query.get_or_404(user_id)
+    blocked = request.form.get('blocked') == '1'
+    try:
+        # Takes effect at once in this process; bot workers pick it up on their next refresh
+        blocklist.blocklist.set_blocked(user, blocked, request.form.get('reason') or None)
+        flash('کاربر مسدود شد.' if blocked else 'کاربر از حالت مسدود خارج شد.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'خطا در تغییر وضعیت کاربر: {str(e)}', 'danger')
+
+    return redirect(url_for('admin.users'))
 
 @bp.route('/send_message', methods=['POST'])
 @login_required
 def send_message():
     try:
-        user_ids = request.form.getlist('user_ids[]')
         message = request.form.get('message')
+        audience = request.form.get('audience', 'selected')
         
         if not message:
             return jsonify({'success': False, 'error': 'پیام نمی‌تواند خالی باشد.'})
         
-        bot_token = Config.TELEGRAM_TOKEN
-        if not bot_token:
+        if not Config.TELEGRAM_TOKEN:
             return jsonify({'success': False, 'error': 'توکن تلگرام یافت نشد.'})
 
-        # Create new event loop for async operations
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        async def send_messages():
-            bot = Bot(token=bot_token)
-            success_count = 0
-            failed_count = 0
-            
-            for user_id in user_ids:
-                user = User.query.get(user_id)
-                if user and user.telegram_id:
-                    try:
-                        await bot.send_message(
-                            chat_id=user.telegram_id,
-                            text=message,
-                            parse_mode='Markdown'
-                        )
-                        success_count += 1
-                    except Exception as e:
-                        logger.error(f"Error sending message to user {user.telegram_id}: {e}")
-                        failed_count += 1
-            
-            return success_count, failed_count
+        if audience not in broadcast.AUDIENCES:
+            return jsonify({'success': False, 'error': 'مخاطبان نامعتبر است.'})
+
+        if audience == 'selected':
+            value = ','.join(request.form.getlist('user_ids[]'))
+        else:
+            value = request.form.get('audience_value')
+        if audience in ('selected', 'active', 'lesson') and not value:
+            return jsonify({'success': False, 'error': 'مخاطبان پیام مشخص نشده است.'})
 
-        # Run the async function
-        success_count, failed_count = loop.run_until_complete(send_messages())
-        loop.close()
+        job = broadcast.create_job(message, audience, value)
+        broadcast.start_job(current_app._get_current_object(), job)
         
         return jsonify({
             'success': True,
-            'message': f'پیام با موفقیت به {success_count} کاربر ارسال شد. {failed_count} ارسال ناموفق.'
+            'job_id': job.id,
+            'progress_url': url_for('admin.broadcast_progress', job_id=job.id),
+            'message': f'ارسال پیام به {job.total} کاربر آغاز شد.'
         })
         
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error in send_message: {e}")
-        return jsonify({'success': False, 'error': str(e)}) 
\ No newline at end of file
+        return jsonify({'success': False, 'error': str(e)})
+
+@bp.route('/broadcasts/<int:job_id>')
+@login_required
+def broadcast_progress(job_id):
+    job = BroadcastJob.query.get_or_404(job_id)
+    return jsonify({
+        'success': True,
+        'status': job.status,
+        'total': job.total,
+        'sent': job.sent,
+        'failed': job.failed,
+        'remaining': job.remaining
+    })
+
+@bp.route('/metrics')
+@login_required
+def metrics_view():
+    metrics.set_gauge('process_rss_bytes', metrics.resident_memory())
+    return jsonify(metrics.snapshot())
+
+@bp.route('/analytics')
+@login_required
+def analytics_view():
+    majors = Major.query.order_by(Major.name).all()
+    lessons = Lesson.query.order_by(Lesson.name).all()
+    return render_template('admin/analytics.html', metrics=analytics.METRICS, majors=majors, lessons=lessons)
+
+@bp.route('/analytics.json')
+@login_required
+def analytics_data():
+    metric = request.args.get('metric', 'downloads')
+    period = request.args.get('period', 'day')
+    dimension = request.args.get('dimension', 'all')
+    dimension_id = request.args.get('dimension_id', 0, type=int)
+    days = request.args.get('days', 365 if period == 'day' else 7, type=int)
+
+    if metric not in analytics.METRICS or period not in ('hour', 'day') or dimension not in ('all', 'lesson', 'major'):
+        return jsonify({'success': False, 'error': 'پارامترهای نامعتبر'}), 400
+
+    points = analytics.series(
+        metric, period, dimension, dimension_id,
+        since=datetime.utcnow() - timedelta(days=days)
+    )
+    return jsonify({
+        'success': True,
+        'metric': metric,
+        'period': period,
+        'points': [{'bucket': bucket.isoformat(), 'value': value} for bucket, value in points]
+    })
+
+@bp.route('/backup')
+@login_required
+def download_backup():
+    incremental = request.args.get('incremental') == '1'
+    filename = f"backup-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}{'-incremental' if incremental else ''}.tar.gz"
+    return Response(
+        backup.stream_backup(incremental),
+        mimetype='application/gzip',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@bp.route('/suggest/<field>')
+@login_required
+def suggest(field):
+    if field not in taxonomy.LEVELS:
+        return jsonify({'error': 'فیلد نامعتبر است.'}), 404
+    position = taxonomy.ORDER.index(field)
+    parent_id = 0
+    if position:
+        parents = taxonomy.ORDER[:position]
+        ids = taxonomy.index.resolve({name: request.args.get(name, '') for name in parents})
+        if parents[-1] not in ids:
+            # The parent is new, so nothing can exist below it yet
+            return jsonify({'suggestions': []})
+        parent_id = ids[parents[-1]]
+    suggestions = taxonomy.index.suggest(field, request.args.get('q', ''), parent_id)
+    return jsonify({'suggestions': suggestions})
@@ -0,0 +1,145 @@
+import fcntl
+import json
+import os
+import time
+import uuid
+
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+PARTIAL_FOLDER = '.partial'
+COPY_BUFFER = 64 * 1024
+
+class UploadError(Exception):
+    """A resumable upload request that cannot be applied; `status` is the HTTP code to answer with."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+def _folder():
+    folder = os.path.join(current_app.config['UPLOAD_FOLDER'], PARTIAL_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def _paths(upload_id):
+    # Ids are generated by start(); anything else could escape the folder
+    try:
+        upload_id = uuid.UUID(upload_id).hex
+    except (ValueError, TypeError):
+        raise UploadError('شناسه آپلود نامعتبر است.', 404)
+    base = os.path.join(_folder(), upload_id)
+    return base + '.part', base + '.json'
+
+def _load(upload_id):
+    data_path, meta_path = _paths(upload_id)
+    if not os.path.exists(meta_path) or not os.path.exists(data_path):
+        raise UploadError('آپلود یافت نشد یا منقضی شده است.', 404)
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    meta['offset'] = os.path.getsize(data_path)
+    return meta, data_path, meta_path
+
+def stored_path(filename):
+    """Return a new, unused path in the upload folder for a file uploaded as `filename`.
+
+    secure_filename() drops non-ASCII characters, so Persian names collapse
+    to little more than 'pdf'; the random prefix keeps every stored file
+    apart, and a name left without its extension is replaced entirely. Notes are shown under Note.name, never under this path.
+    """
+    name = secure_filename(filename)
+    stored = f'{uuid.uuid4().hex}-{name}' if '.' in name else f'{uuid.uuid4().hex}.pdf'
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], stored)
+
+def save(file):
+    """Save a file posted in one request under a new path and return it."""
+    file_path = stored_path(file.filename)
+    file.save(file_path)
+    return file_path
+
+def purge_expired():
+    """Remove partial uploads that have not received a chunk within the expiry window."""
+    cutoff = time.time() - current_app.config['UPLOAD_PARTIAL_EXPIRY_HOURS'] * 3600
+    folder = _folder()
+    for upload_id in {os.path.splitext(name)[0] for name in os.listdir(folder)}:
+        data_path, meta_path = (os.path.join(folder, upload_id + suffix) for suffix in ('.part', '.json'))
+        # Only the data file is written as chunks arrive; the meta file keeps its creation time
+        try:
+            last_chunk = os.path.getmtime(data_path if os.path.exists(data_path) else meta_path)
+        except OSError:
+            continue
+        if last_chunk < cutoff:
+            for path in (data_path, meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+def start(filename, size):
+    """Register a new upload of `size` bytes and return its status."""
+    if not filename.lower().endswith('.pdf'):
+        raise UploadError('فقط فایل‌های PDF مجاز هستند')
+    if size <= 0:
+        raise UploadError('حجم فایل نامعتبر است.')
+
+    purge_expired()
+    upload_id = uuid.uuid4().hex
+    data_path, meta_path = _paths(upload_id)
+    open(data_path, 'wb').close()
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'filename': filename, 'size': size}, f, ensure_ascii=False)
+    return status(upload_id)
+
+def status(upload_id):
+    """Return {'upload_id', 'offset', 'size', 'chunk_size'}; clients resume from `offset`."""
+    meta, _, _ = _load(upload_id)
+    return {
+        'upload_id': uuid.UUID(upload_id).hex,
+        'offset': meta['offset'],
+        'size': meta['size'],
+        'chunk_size': current_app.config['UPLOAD_CHUNK_SIZE']
+    }
+
+def append(upload_id, offset, stream):
+    """Write the chunk in `stream` at `offset` and return the new status.
+
+    The chunk is copied to disk in small buffers, so a worker never holds
+    more than COPY_BUFFER bytes of it. A chunk must start exactly where the
+    stored data ends; otherwise the client is told the real offset. The
+    part file is locked while the offset is checked and the chunk written,
+    so concurrent requests for one upload are applied one at a time.
+    """
+    meta, data_path, _ = _load(upload_id)
+    with open(data_path, 'ab') as out:
+        # Held until the chunk is written, so a retried chunk racing the
+        # original sees the new size instead of appending the bytes twice
+        fcntl.flock(out, fcntl.LOCK_EX)
+        stored = os.fstat(out.fileno()).st_size
+        if offset != stored:
+            raise UploadError('موقعیت بخش با فایل ذخیره‌شده همخوانی ندارد.', 409, stored)
+
+        written = stored
+        while True:
+            buffer = stream.read(COPY_BUFFER)
+            if not buffer:
+                break
+            written += len(buffer)
+            if written > meta['size']:
+                out.truncate(stored)
+                raise UploadError('حجم ارسال‌شده از حجم اعلام‌شده بیشتر است.')
+            out.write(buffer)
+    return status(upload_id)
+
+def finish(upload_id):
+    """Move a complete upload to a new path in the upload folder and return that path."""
+    meta, data_path, meta_path = _load(upload_id)
+    if meta['offset'] != meta['size']:
+        raise UploadError('آپلود فایل کامل نشده است.', 409, meta['offset'])
+
+    with open(data_path, 'rb') as f:
+        if f.read(5) != b'%PDF-':
+            raise UploadError('فایل ارسال‌شده PDF معتبر نیست.')
+
+    file_path = stored_path(meta['filename'])
+    os.replace(data_path, file_path)
+    os.remove(meta_path)
+    return file_path
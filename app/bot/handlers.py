@@ -1,23 +1,45 @@
 import os
+import html
 import logging
 from datetime import datetime
+from pathlib import Path
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     CallbackContext,
-    ConversationHandler,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters
 )
 
-from app.models.database import db, Major, Semester, Lesson, Teacher, Note, Subscription, User
+from app.models.database import db, Major, Semester, Lesson, Teacher, Note, User, Rating
+from app.bot.throttle import FloodControl, drop_blocked
+from app.bot import navigation
+from app.bot.navigation import Nav, CallbackCodec
+from app.bot.pagination import parse_cursor, fetch_page, page_buttons
+from app.utils.downloads import counters as download_counters, top_downloads
+from app.utils import bundles, fulltext, ranking, profiling, subscriptions
 
-# Define conversation states
-CHOOSING, MAJOR, SEMESTER, LESSON, TEACHER, NOTES, RATING = range(7)
+# Handler groups; lower groups run first and may stop further dispatch
+BLOCKLIST_GROUP = -2
+PRE_DISPATCH_GROUP = -1
+MENU_GROUP = 0
 
 logger = logging.getLogger(__name__)
 
+# Telegram rejects messages over 4096 characters; replies built from results stop short of it
+MAX_REPLY_LENGTH = 4000
+
+# What a subscription button on each list screen covers, by the path field keying the screen
+SCOPE_NAMES = {
+    'major_id': "این رشته",
+    'semester_id': "این نیمسال",
+    'lesson_id': "این درس",
+    'teacher_id': "این استاد"
+}
+
 def format_date(date):
     """Format date as string."""
     if not date:
@@ -27,49 +49,77 @@ def format_date(date):
 class TelegramBotHandlers:
     def __init__(self, app):
         self.app = app
-
-    def get_handlers(self):
-        """Return the conversation handler with all states and callbacks."""
-        conv_handler = ConversationHandler(
-            entry_points=[
-                CommandHandler('start', self.start),
-                CallbackQueryHandler(self.start, pattern='^start$')
-            ],
-            states={
-                CHOOSING: [
-                    CallbackQueryHandler(self.browse_notes, pattern='^browse$'),
-                    CallbackQueryHandler(self.about, pattern='^about$'),
-                    CallbackQueryHandler(self.start, pattern='^back$'),
-                ],
-                MAJOR: [
-                    CallbackQueryHandler(self.handle_major, pattern='^(major_|back$)'),
-                ],
-                SEMESTER: [
-                    CallbackQueryHandler(self.handle_semester, pattern='^(semester_|back$)'),
-                ],
-                LESSON: [
-                    CallbackQueryHandler(self.handle_subscription, pattern='^(subscribe_|unsubscribe_)'),
-                    CallbackQueryHandler(self.handle_lesson, pattern='^(lesson_|back$)'),
-                ],
-                TEACHER: [
-                    CallbackQueryHandler(self.handle_subscription, pattern='^(subscribe_|unsubscribe_)'),
-                    CallbackQueryHandler(self.handle_teacher, pattern='^(teacher_|back$)'),
-                ],
-                RATING: [
-                    CallbackQueryHandler(self.handle_rating, pattern='^(rate_|back$)'),
-                    CallbackQueryHandler(self.start, pattern='^start$'),
-                ]
-            },
-            fallbacks=[
-                CommandHandler('start', self.start),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, self.start)
-            ],
-            per_message=False
+        self.flood_control = FloodControl(
+            rate=app.config['FLOOD_RATE'],
+            burst=app.config['FLOOD_BURST'],
+            idle_seconds=app.config['FLOOD_IDLE_SECONDS'],
+            max_users=app.config['FLOOD_MAX_USERS']
         )
-        return [conv_handler]
+        self.codec = CallbackCodec(app.config['SECRET_KEY'])
+        # Screens by the character that names them in callback_data; wrapped so
+        # slow update profiles name the screen that was rendered
+        self.views = {
+            view: profiling.track_handler(callback) for view, callback in {
+                navigation.HOME: self.start,
+                navigation.MAJORS: self.browse_notes,
+                navigation.SEMESTERS: self.handle_major,
+                navigation.LESSONS: self.handle_semester,
+                navigation.TEACHERS: self.handle_lesson,
+                navigation.NOTES: self.handle_teacher,
+                navigation.SUBSCRIBE: self.handle_subscription,
+                navigation.UNSUBSCRIBE: self.handle_subscription,
+                navigation.LESSON_TOP: self.show_top_downloads,
+                navigation.BUNDLE: self.send_bundle,
+                navigation.TOP_DOWNLOADS: self.show_top_downloads,
+                navigation.TOP_RATED: self.show_top_notes,
+                navigation.TRENDING: self.show_top_notes,
+                navigation.ABOUT: self.about,
+                navigation.TOGGLE_DIGEST: self.toggle_digest,
+                navigation.RATE: self.handle_rating
+            }.items()
+        }
 
-    async def start(self, update: Update, context: CallbackContext) -> int:
-        """Start the conversation and display the main menu."""
+    def get_handlers(self):
+        """Return handlers by group: pre-dispatch filters first, then the menus."""
+        return {
+            BLOCKLIST_GROUP: [TypeHandler(Update, drop_blocked)],
+            PRE_DISPATCH_GROUP: [TypeHandler(Update, self.flood_control.check)],
+            MENU_GROUP: [
+                CommandHandler('start', profiling.track_handler(self.start)),
+                CommandHandler('search', profiling.track_handler(self.search)),
+                CallbackQueryHandler(self.navigate),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, profiling.track_handler(self.start))
+            ]
+        }
+
+    def _button(self, text, nav):
+        return InlineKeyboardButton(text, callback_data=self.codec.encode(nav))
+
+    def _page_buttons(self, nav, prev_token, next_token):
+        return page_buttons(lambda token: self.codec.encode(nav.to(nav.view, page=token)), prev_token, next_token)
+
+    def _subscription_button(self, nav, telegram_id):
+        """The subscribe/unsubscribe toggle for the level `nav` lists; requires an app context."""
+        _, key = nav.scope()
+        if subscriptions.is_subscribed(telegram_id, key[:-len('_id')], getattr(nav, key)):
+            return self._button(f"🔕 لغو اعلان‌های {SCOPE_NAMES[key]}", nav.to(navigation.UNSUBSCRIBE, nav.page))
+        return self._button(f"🔔 اعلان جزوه‌های {SCOPE_NAMES[key]}", nav.to(navigation.SUBSCRIBE, nav.page))
+
+    async def navigate(self, update: Update, context: CallbackContext) -> None:
+        """Render the screen named by a button's signed callback_data.
+
+        Everything a screen needs, including where its back button leads,
+        is in the callback itself, so any worker can serve any button.
+        """
+        nav = self.codec.decode(update.callback_query.data)
+        view = self.views.get(nav.view) if nav else None
+        if view is None:
+            await self.stale_button(update, context)
+            return
+        await view(update, context, nav)
+
+    async def start(self, update: Update, context: CallbackContext, nav=None, notice=None) -> None:
+        """Register the user and display the main menu, optionally answering with `notice`."""
         try:
             with self.app.app_context():
                 # Create or update user
@@ -95,19 +145,29 @@ class TelegramBotHandlers:
                         await update.message.reply_text(
                             "⛔️ شما از استفاده از ربات محدود شده‌اید. لطفاً با مدیر تماس بگیرید."
                         )
-                    return ConversationHandler.END
+                    return
 
                 # Handle note_id from deep linking
                 if context.args and context.args[0].startswith('note_'):
                     try:
                         note_id = int(context.args[0].split('_')[1])
-                        return await self.send_note(update, context, note_id)
+                        await self.send_note(update, context, note_id)
+                        return
                     except (ValueError, IndexError):
                         logger.error("Invalid note_id in deep link")
                 
                 keyboard = [
-                    [InlineKeyboardButton("📚 مرور جزوه‌ها", callback_data='browse')],
-                    [InlineKeyboardButton("ℹ️ درباره ربات", callback_data='about')]
+                    [self._button("📚 مرور جزوه‌ها", Nav(navigation.MAJORS))],
+                    [self._button("🔥 پردانلودترین‌های هفته", Nav(navigation.TOP_DOWNLOADS))],
+                    [
+                        self._button("⭐ برترین جزوه‌ها", Nav(navigation.TOP_RATED)),
+                        self._button("📈 جزوه‌های داغ", Nav(navigation.TRENDING))
+                    ],
+                    [self._button(
+                        "🗞 اعلان‌های خلاصه: روشن" if user.digest_mode else "🗞 اعلان‌های خلاصه: خاموش",
+                        Nav(navigation.TOGGLE_DIGEST)
+                    )],
+                    [self._button("ℹ️ درباره ربات", Nav(navigation.ABOUT))]
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 
@@ -118,12 +178,10 @@ class TelegramBotHandlers:
                 )
                 
                 if update.callback_query:
-                    await update.callback_query.answer()
+                    await update.callback_query.answer(notice)
                     await update.callback_query.message.edit_text(text, reply_markup=reply_markup)
                 else:
                     await update.message.reply_text(text, reply_markup=reply_markup)
-                
-                return CHOOSING
 
         except Exception as e:
             logger.error(f"Error in start handler: {e}")
@@ -134,47 +192,58 @@ class TelegramBotHandlers:
                     await update.message.reply_text("خطایی رخ داد. لطفاً دوباره تلاش کنید.")
             except Exception as inner_e:
                 logger.error(f"Error sending error message: {inner_e}")
-            return CHOOSING
 
-    async def browse_notes(self, update: Update, context: CallbackContext) -> int:
+    async def browse_notes(self, update: Update, context: CallbackContext, nav: Nav) -> None:
         """Show available majors."""
         query = update.callback_query
         await query.answer()
 
+        cursor = parse_cursor(nav.page)
+
         with self.app.app_context():
-            majors = Major.query.all()
+            majors, prev_token, next_token = fetch_page(
+                Major.query, Major.id, cursor, self.app.config['BOT_PAGE_SIZE']
+            )
             keyboard = [
-                [InlineKeyboardButton(major.name, callback_data=f'major_{major.id}')]
+                [self._button(major.name, nav.to(navigation.SEMESTERS, major_id=major.id))]
                 for major in majors
             ]
-            keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data='back')])
+            pages = self._page_buttons(nav, prev_token, next_token)
+            if pages:
+                keyboard.append(pages)
+            keyboard.append([self._button("🔙 بازگشت", nav.back())])
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             await query.message.edit_text(
                 "لطفاً رشته تحصیلی خود را انتخاب کنید:",
                 reply_markup=reply_markup
             )
-            return MAJOR
 
-    async def handle_major(self, update: Update, context: CallbackContext) -> int:
+    async def handle_major(self, update: Update, context: CallbackContext, nav: Nav, notice=None) -> None:
         """Handle major selection and show semesters."""
         query = update.callback_query
-        await query.answer()
-
-        if query.data == 'back':
-            return await self.start(update, context)
-
-        major_id = int(query.data.split('_')[1])
-        context.user_data['major_id'] = major_id
+        major_id = nav.major_id
+        cursor = parse_cursor(nav.page)
 
         with self.app.app_context():
-            semesters = Semester.query.filter_by(major_id=major_id).all()
             major = Major.query.get(major_id)
+            if major is None:
+                await self.missing_item(update, context)
+                return
+            await query.answer(notice)
+            semesters, prev_token, next_token = fetch_page(
+                Semester.query.filter_by(major_id=major_id), Semester.id,
+                cursor, self.app.config['BOT_PAGE_SIZE']
+            )
             keyboard = [
-                [InlineKeyboardButton(semester.name, callback_data=f'semester_{semester.id}')]
+                [self._button(semester.name, nav.to(navigation.LESSONS, semester_id=semester.id))]
                 for semester in semesters
             ]
-            keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data='back')])
+            pages = self._page_buttons(nav, prev_token, next_token)
+            if pages:
+                keyboard.append(pages)
+            keyboard.append([self._subscription_button(nav, query.from_user.id)])
+            keyboard.append([self._button("🔙 بازگشت", nav.back())])
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             await query.message.edit_text(
@@ -182,27 +251,32 @@ class TelegramBotHandlers:
                 "لطفاً نیمسال را انتخاب کنید:",
                 reply_markup=reply_markup
             )
-            return SEMESTER
 
-    async def handle_semester(self, update: Update, context: CallbackContext) -> int:
+    async def handle_semester(self, update: Update, context: CallbackContext, nav: Nav, notice=None) -> None:
         """Handle semester selection and show lessons."""
         query = update.callback_query
-        await query.answer()
-
-        if query.data == 'back':
-            return await self.browse_notes(update, context)
-
-        semester_id = int(query.data.split('_')[1])
-        context.user_data['semester_id'] = semester_id
+        semester_id = nav.semester_id
+        cursor = parse_cursor(nav.page)
 
         with self.app.app_context():
-            lessons = Lesson.query.filter_by(semester_id=semester_id).all()
             semester = Semester.query.get(semester_id)
+            if semester is None:
+                await self.missing_item(update, context)
+                return
+            await query.answer(notice)
+            lessons, prev_token, next_token = fetch_page(
+                Lesson.query.filter_by(semester_id=semester_id), Lesson.id,
+                cursor, self.app.config['BOT_PAGE_SIZE']
+            )
             keyboard = [
-                [InlineKeyboardButton(lesson.name, callback_data=f'lesson_{lesson.id}')]
+                [self._button(lesson.name, nav.to(navigation.TEACHERS, lesson_id=lesson.id))]
                 for lesson in lessons
             ]
-            keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data='back')])
+            pages = self._page_buttons(nav, prev_token, next_token)
+            if pages:
+                keyboard.append(pages)
+            keyboard.append([self._subscription_button(nav, query.from_user.id)])
+            keyboard.append([self._button("🔙 بازگشت", nav.back())])
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             await query.message.edit_text(
@@ -210,83 +284,75 @@ class TelegramBotHandlers:
                 "لطفاً درس مورد نظر را انتخاب کنید:",
                 reply_markup=reply_markup
             )
-            return LESSON
 
-    async def handle_lesson(self, update: Update, context: CallbackContext) -> int:
+    def _teachers_keyboard(self, nav, telegram_id):
+        """Build one page of a lesson's teachers plus the subscription button."""
+        teachers, prev_token, next_token = fetch_page(
+            Teacher.query.filter_by(lesson_id=nav.lesson_id), Teacher.id,
+            parse_cursor(nav.page), self.app.config['BOT_PAGE_SIZE']
+        )
+        keyboard = [
+            [self._button(teacher.name, nav.to(navigation.NOTES, teacher_id=teacher.id))]
+            for teacher in teachers
+        ]
+        pages = self._page_buttons(nav, prev_token, next_token)
+        if pages:
+            keyboard.append(pages)
+        keyboard.append([self._button("🔥 پردانلودترین‌های این درس", nav.to(navigation.LESSON_TOP))])
+        keyboard.append([self._button("📦 دانلود همه جزوه‌های این درس", nav.to(navigation.BUNDLE))])
+
+        keyboard.append([self._subscription_button(nav, telegram_id)])
+        keyboard.append([self._button("🔙 بازگشت", nav.back())])
+        return InlineKeyboardMarkup(keyboard)
+
+    async def handle_lesson(self, update: Update, context: CallbackContext, nav: Nav, notice=None) -> None:
         """Handle lesson selection and show teachers."""
         query = update.callback_query
-        await query.answer()
-
-        if query.data == 'back':
-            semester_id = context.user_data.get('semester_id')
-            if semester_id:
-                return await self.handle_semester(update, context)
-            return await self.browse_notes(update, context)
-
-        lesson_id = int(query.data.split('_')[1])
-        context.user_data['lesson_id'] = lesson_id
+        lesson_id = nav.lesson_id
 
         with self.app.app_context():
-            teachers = Teacher.query.filter_by(lesson_id=lesson_id).all()
             lesson = Lesson.query.get(lesson_id)
-            
-            user = User.query.filter_by(telegram_id=query.from_user.id).first()
-            if not user:
-                user = User(telegram_id=query.from_user.id, username=query.from_user.username)
-                db.session.add(user)
-                db.session.commit()
-            
-            is_subscribed = Subscription.query.filter_by(
-                user_id=user.id,
-                lesson_id=lesson_id
-            ).first() is not None
-
-            keyboard = [
-                [InlineKeyboardButton(teacher.name, callback_data=f'teacher_{teacher.id}')]
-                for teacher in teachers
-            ]
-            
-            sub_button = InlineKeyboardButton(
-                "🔕 لغو اشتراک" if is_subscribed else "🔔 دریافت اعلان",
-                callback_data=f'{"unsubscribe" if is_subscribed else "subscribe"}_{lesson_id}'
-            )
-            keyboard.append([sub_button])
-            keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data='back')])
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            if lesson is None:
+                await self.missing_item(update, context)
+                return
+            await query.answer(notice)
+            reply_markup = self._teachers_keyboard(nav, query.from_user.id)
 
             await query.message.edit_text(
                 f"اساتید درس {lesson.name}:\n"
                 "لطفاً استاد مورد نظر را انتخاب کنید:",
                 reply_markup=reply_markup
             )
-            return TEACHER
 
-    async def handle_teacher(self, update: Update, context: CallbackContext) -> int:
+    async def handle_teacher(self, update: Update, context: CallbackContext, nav: Nav, notice=None) -> None:
         """Handle teacher selection and show notes."""
         query = update.callback_query
-        await query.answer()
-
-        if query.data == 'back':
-            lesson_id = context.user_data.get('lesson_id')
-            if lesson_id:
-                return await self.handle_lesson(update, context)
-            return await self.browse_notes(update, context)
-
-        teacher_id = int(query.data.split('_')[1])
-        context.user_data['teacher_id'] = teacher_id
+        teacher_id = nav.teacher_id
+        cursor = parse_cursor(nav.page)
 
         with self.app.app_context():
             teacher = Teacher.query.get(teacher_id)
-            notes = Note.query.filter_by(teacher_id=teacher_id).all()
+            if teacher is None:
+                await self.missing_item(update, context)
+                return
+            await query.answer(notice)
+            notes, prev_token, next_token = fetch_page(
+                Note.query.filter_by(teacher_id=teacher_id), Note.id,
+                cursor, self.app.config['BOT_NOTES_PAGE_SIZE'],
+                rank=ranking.listing_rank()
+            )
             
             if not notes:
-                keyboard = [[InlineKeyboardButton("🔙 بازگشت", callback_data='back')]]
+                keyboard = [
+                    [self._subscription_button(nav, query.from_user.id)],
+                    [self._button("🔙 بازگشت", nav.back())]
+                ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 await query.message.edit_text(
                     f"هیچ جزوه‌ای برای {teacher.name} یافت نشد.",
                     reply_markup=reply_markup
                 )
-                return TEACHER
+                return
 
             overview = f"جزوه‌های درس {teacher.lesson.name} استاد {teacher.name}:\n\n"
             keyboard = []
@@ -300,7 +366,11 @@ class TelegramBotHandlers:
                     f"[📥 دانلود جزوه](https://t.me/{context.bot.username}?start=note_{note.id})\n\n"
                 )
 
-            keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data='back')])
+            pages = self._page_buttons(nav, prev_token, next_token)
+            if pages:
+                keyboard.append(pages)
+            keyboard.append([self._subscription_button(nav, query.from_user.id)])
+            keyboard.append([self._button("🔙 بازگشت", nav.back())])
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             await query.message.edit_text(
@@ -309,30 +379,32 @@ class TelegramBotHandlers:
                 parse_mode='Markdown',
                 disable_web_page_preview=True
             )
-            return TEACHER
 
-    async def handle_rating(self, update: Update, context: CallbackContext) -> int:
+    async def handle_rating(self, update: Update, context: CallbackContext, nav: Nav) -> None:
         """Handle rating submission."""
         query = update.callback_query
         await query.answer()
 
-        if query.data == 'back':
-            return await self.start(update, context)
-
         try:
-            rating_data = query.data.split('_')
-            if len(rating_data) == 3 and rating_data[0] == 'rate':
-                note_id = int(rating_data[1])
-                rating = int(rating_data[2])
+            if nav.note_id is not None and nav.value in range(1, 6):
+                note_id = nav.note_id
+                rating = nav.value
 
                 with self.app.app_context():
                     note = Note.query.get(note_id)
                     if note:
                         note.rating_sum = (note.rating_sum or 0) + rating
                         note.rating_count = (note.rating_count or 0) + 1
+                        ranking.record_rating(note)
+                        user = User.query.filter_by(telegram_id=query.from_user.id).first()
+                        db.session.add(Rating(
+                            value=rating,
+                            note_id=note.id,
+                            user_id=user.id if user else None
+                        ))
                         db.session.commit()
 
-                        keyboard = [[InlineKeyboardButton("🔙 بازگشت به منو", callback_data='back')]]
+                        keyboard = [[self._button("🔙 بازگشت به منو", Nav(navigation.HOME))]]
                         reply_markup = InlineKeyboardMarkup(keyboard)
 
                         await query.message.edit_text(
@@ -341,92 +413,56 @@ class TelegramBotHandlers:
                             "برای بازگشت به منوی اصلی روی دکمه زیر کلیک کنید.",
                             reply_markup=reply_markup
                         )
-                        return RATING
+                        return
 
-            keyboard = [[InlineKeyboardButton("🔙 بازگشت به منو", callback_data='back')]]
+            keyboard = [[self._button("🔙 بازگشت به منو", Nav(navigation.HOME))]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await query.message.edit_text(
                 "خطا در ثبت امتیاز. لطفاً دوباره تلاش کنید.\n\n"
                 "برای بازگشت به منوی اصلی روی دکمه زیر کلیک کنید.",
                 reply_markup=reply_markup
             )
-            return RATING
 
         except Exception as e:
             logger.error(f"Error handling rating: {e}")
-            keyboard = [[InlineKeyboardButton("🔙 بازگشت به منو", callback_data='back')]]
+            keyboard = [[self._button("🔙 بازگشت به منو", Nav(navigation.HOME))]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await query.message.edit_text(
                 "خطا در ثبت امتیاز. لطفاً دوباره تلاش کنید.\n\n"
                 "برای بازگشت به منوی اصلی روی دکمه زیر کلیک کنید.",
                 reply_markup=reply_markup
             )
-            return RATING
 
-    async def handle_subscription(self, update: Update, context: CallbackContext) -> int:
-        """Handle subscription/unsubscription to lessons."""
+    async def handle_subscription(self, update: Update, context: CallbackContext, nav: Nav) -> None:
+        """Subscribe to or unsubscribe from the level the pressed screen lists, then redraw that screen."""
         query = update.callback_query
-        await query.answer()
-
-        action, lesson_id = query.data.split('_')
-        lesson_id = int(lesson_id)
-        context.user_data['lesson_id'] = lesson_id
+        scope = nav.scope()
+        if scope is None:
+            await self.stale_button(update, context)
+            return
+        view, key = scope
+        level, scope_id = key[:-len('_id')], getattr(nav, key)
 
         with self.app.app_context():
+            if not db.session.get(subscriptions.MODELS[level], scope_id):
+                await self.missing_item(update, context)
+                return
+
             user = User.query.filter_by(telegram_id=query.from_user.id).first()
             if not user:
                 user = User(telegram_id=query.from_user.id, username=query.from_user.username)
                 db.session.add(user)
                 db.session.commit()
 
-            lesson = Lesson.query.get(lesson_id)
-            if not lesson:
-                await query.message.edit_text("درس مورد نظر یافت نشد.")
-                return CHOOSING
-
-            existing_sub = Subscription.query.filter_by(
-                user_id=user.id,
-                lesson_id=lesson_id
-            ).first()
-
-            message = ""
-            if action == 'subscribe' and not existing_sub:
-                subscription = Subscription(user_id=user.id, lesson_id=lesson_id)
-                db.session.add(subscription)
-                db.session.commit()
-                message = "✅ شما با موفقیت مشترک دریافت اعلان‌های جزوه‌های جدید شدید!"
-            elif action == 'unsubscribe' and existing_sub:
-                db.session.delete(existing_sub)
-                db.session.commit()
-                message = "✅ اشتراک شما با موفقیت لغو شد."
+            notice = None
+            if nav.view == navigation.SUBSCRIBE and subscriptions.subscribe(user, level, scope_id):
+                notice = "✅ شما با موفقیت مشترک دریافت اعلان‌های جزوه‌های جدید شدید!"
+            elif nav.view == navigation.UNSUBSCRIBE and subscriptions.unsubscribe(user, level, scope_id):
+                notice = "✅ اشتراک شما با موفقیت لغو شد."
 
-            teachers = Teacher.query.filter_by(lesson_id=lesson_id).all()
-            is_subscribed = Subscription.query.filter_by(
-                user_id=user.id,
-                lesson_id=lesson_id
-            ).first() is not None
+        await self.views[view](update, context, nav.to(view, nav.page), notice=notice)
 
-            keyboard = [
-                [InlineKeyboardButton(teacher.name, callback_data=f'teacher_{teacher.id}')]
-                for teacher in teachers
-            ]
-            sub_button = InlineKeyboardButton(
-                "🔕 لغو اشتراک" if is_subscribed else "🔔 دریافت اعلان",
-                callback_data=f'{"unsubscribe" if is_subscribed else "subscribe"}_{lesson_id}'
-            )
-            keyboard.append([sub_button])
-            keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data='back')])
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            text = f"اساتید درس {lesson.name}:\n"
-            if message:
-                text += f"\n{message}\n\n"
-            text += "لطفاً استاد مورد نظر را انتخاب کنید:"
-            
-            await query.message.edit_text(text, reply_markup=reply_markup)
-            return TEACHER
-
-    async def send_note(self, update: Update, context: CallbackContext, note_id: int) -> int:
+    async def send_note(self, update: Update, context: CallbackContext, note_id: int) -> None:
         """Send a note to the user."""
         with self.app.app_context():
             try:
@@ -438,23 +474,40 @@ class TelegramBotHandlers:
 
                 note = Note.query.get(note_id)
                 if note and os.path.exists(note.file_path):
+                    file_path = note.delivery_path
+                    if os.path.getsize(file_path) > self.app.config['TELEGRAM_MAX_FILE_MB'] * 1024 * 1024:
+                        await context.bot.send_message(
+                            chat_id=chat_id,
+                            text="حجم این جزوه از حد مجاز ارسال در تلگرام بیشتر است."
+                        )
+                        return
                     try:
-                        with open(note.file_path, 'rb') as file:
+                        if self.app.config['TELEGRAM_LOCAL_MODE']:
+                            # A local Bot API server reads the file from disk itself
                             sent_file = await context.bot.send_document(
                                 chat_id=chat_id,
-                                document=file,
-                                read_timeout=60,
+                                document=Path(file_path),
+                                read_timeout=300,
                                 write_timeout=60
                             )
+                        else:
+                            with open(file_path, 'rb') as file:
+                                sent_file = await context.bot.send_document(
+                                    chat_id=chat_id,
+                                    document=file,
+                                    read_timeout=60,
+                                    write_timeout=60
+                                )
+                        download_counters.record(note_id, update.effective_user.id)
                         
                         keyboard = []
                         rating_buttons = []
                         for i in range(1, 6):
                             rating_buttons.append(
-                                InlineKeyboardButton(f"{i}⭐", callback_data=f'rate_{note_id}_{i}')
+                                self._button(f"{i}⭐", Nav(navigation.RATE, note_id=note_id, value=i))
                             )
                         keyboard.append(rating_buttons)
-                        keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data='back')])
+                        keyboard.append([self._button("🔙 بازگشت", Nav(navigation.HOME))])
                         reply_markup = InlineKeyboardMarkup(keyboard)
                         
                         description_text = f"📋 توضیحات:\n{note.description}\n\n" if note.description else ""
@@ -476,7 +529,7 @@ class TelegramBotHandlers:
                             reply_markup=reply_markup,
                             parse_mode='Markdown'
                         )
-                        return RATING
+                        return
                         
                     except Exception as e:
                         logger.error(f"Error sending note: {e}")
@@ -497,9 +550,181 @@ class TelegramBotHandlers:
                     await update.callback_query.answer(f"خطا: {str(e)}", show_alert=True)
                 else:
                     await update.message.reply_text(f"خطا: {str(e)}")
-            return RATING
 
-    async def about(self, update: Update, context: CallbackContext) -> int:
+    async def send_bundle(self, update: Update, context: CallbackContext, nav: Nav) -> None:
+        """Send every note of a lesson as one ZIP, reusing the cached bundle while it is current."""
+        query = update.callback_query
+        await query.answer("📦 در حال آماده‌سازی فایل...")
+        chat_id = query.message.chat_id
+
+        with self.app.app_context():
+            try:
+                lesson = Lesson.query.get(nav.lesson_id)
+                notes = bundles.lesson_notes(lesson.id) if lesson else []
+                if not notes:
+                    await context.bot.send_message(chat_id=chat_id, text="هیچ جزوه‌ای برای این درس یافت نشد.")
+                    return
+                if bundles.content_size(notes) > self.app.config['TELEGRAM_MAX_FILE_MB'] * 1024 * 1024:
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text="حجم جزوه‌های این درس از حد مجاز ارسال در تلگرام بیشتر است."
+                    )
+                    return
+
+                bundle = await bundles.fetch(lesson.id, notes, self.app.config['BUNDLE_FOLDER'])
+                caption = f"📦 همه جزوه‌های درس {lesson.name} ({bundle.note_count} جزوه)"
+                sent_file = None
+                if bundle.telegram_file_id:
+                    try:
+                        sent_file = await context.bot.send_document(
+                            chat_id=chat_id,
+                            document=bundle.telegram_file_id,
+                            caption=caption
+                        )
+                    except BadRequest as e:
+                        logger.warning(f"Cached bundle of lesson {lesson.id} was rejected, uploading again: {e}")
+
+                if sent_file is None:
+                    filename = f"{lesson.name}.zip"
+                    if self.app.config['TELEGRAM_LOCAL_MODE']:
+                        sent_file = await context.bot.send_document(
+                            chat_id=chat_id,
+                            document=Path(bundle.path),
+                            filename=filename,
+                            caption=caption,
+                            read_timeout=300,
+                            write_timeout=60
+                        )
+                    else:
+                        with open(bundle.path, 'rb') as file:
+                            sent_file = await context.bot.send_document(
+                                chat_id=chat_id,
+                                document=file,
+                                filename=filename,
+                                caption=caption,
+                                read_timeout=60,
+                                write_timeout=300
+                            )
+                    bundles.remember_file_id(bundle, sent_file.document.file_id)
+
+                for note in notes:
+                    download_counters.record(note.id, update.effective_user.id)
+
+            except Exception as e:
+                logger.error(f"Error sending bundle: {e}")
+                await context.bot.send_message(
+                    chat_id=chat_id,
+                    text="خطا در ارسال فایل. لطفاً دوباره تلاش کنید."
+                )
+
+    async def stale_button(self, update: Update, context: CallbackContext) -> None:
+        """Answer a button that is unsigned, forged or from an older bot version and reopen the main menu."""
+        await self.start(update, context, notice="⌛ این دکمه منقضی شده است؛ از منوی اصلی ادامه دهید.")
+
+    async def missing_item(self, update: Update, context: CallbackContext) -> None:
+        """Answer a button naming a major, semester, lesson or teacher deleted since and reopen the main menu."""
+        await self.start(update, context, notice="مورد انتخاب‌شده دیگر وجود ندارد.")
+
+    async def toggle_digest(self, update: Update, context: CallbackContext, nav: Nav) -> None:
+        """Switch the user between immediate and digest notifications."""
+        with self.app.app_context():
+            user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+            if user:
+                user.digest_mode = not user.digest_mode
+                db.session.commit()
+        await self.start(update, context)
+
+    async def show_top_downloads(self, update: Update, context: CallbackContext, nav: Nav) -> None:
+        """Show the most downloaded notes of the week, globally or for one lesson."""
+        query = update.callback_query
+        await query.answer()
+
+        lesson_id = nav.lesson_id if nav.view == navigation.LESSON_TOP else None
+
+        with self.app.app_context():
+            top_notes = top_downloads(
+                lesson_id=lesson_id,
+                ttl=self.app.config['TOP_DOWNLOADS_CACHE_SECONDS']
+            )
+
+        text = "🔥 پردانلودترین جزوه‌های هفته:\n\n"
+        for rank, note in enumerate(top_notes, 1):
+            text += (
+                f"{rank}. [{note['name']}](https://t.me/{context.bot.username}?start=note_{note['id']})"
+                f" - {note['lesson']} ({note['downloads']} دانلود)\n"
+            )
+        if not top_notes:
+            text += "هنوز دانلودی در این هفته ثبت نشده است."
+
+        reply_markup = InlineKeyboardMarkup([[self._button("🔙 بازگشت", nav.back())]])
+        await query.message.edit_text(
+            text,
+            reply_markup=reply_markup,
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        )
+
+    async def show_top_notes(self, update: Update, context: CallbackContext, nav: Nav) -> None:
+        """Show the best rated or currently trending notes."""
+        query = update.callback_query
+        await query.answer()
+
+        with self.app.app_context():
+            notes = ranking.top_notes(order='rated' if nav.view == navigation.TOP_RATED else 'trending')
+
+            if nav.view == navigation.TOP_RATED:
+                text = "⭐ برترین جزوه‌ها بر اساس امتیاز:\n\n"
+            else:
+                text = "📈 جزوه‌های داغ این روزها:\n\n"
+            for rank, note in enumerate(notes, 1):
+                text += (
+                    f"{rank}. [{note.name}](https://t.me/{context.bot.username}?start=note_{note.id})"
+                    f" - {note.teacher.lesson.name} ({note.average_rating:.1f}⭐، {note.rating_count} رأی)\n"
+                )
+            if not notes:
+                text += "هنوز جزوه‌ای برای نمایش وجود ندارد."
+
+        reply_markup = InlineKeyboardMarkup([[self._button("🔙 بازگشت", nav.back())]])
+        await query.message.edit_text(
+            text,
+            reply_markup=reply_markup,
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        )
+
+    async def search(self, update: Update, context: CallbackContext) -> None:
+        """Search the text of every note for the words after /search and list matching pages."""
+        terms = ' '.join(context.args or [])
+        if not terms:
+            await update.message.reply_text(
+                "برای جستجو در متن جزوه‌ها، عبارت مورد نظر را بعد از دستور بنویسید:\n"
+                "/search قضیه رول"
+            )
+            return
+
+        with self.app.app_context():
+            results = fulltext.search(terms, limit=self.app.config['SEARCH_RESULTS'])
+            lines = [f"🔎 نتایج جستجو برای «{html.escape(terms[:100])}»:\n"]
+            for note, pages in results:
+                lines.append(
+                    f'📝 <a href="https://t.me/{context.bot.username}?start=note_{note.id}">{html.escape(note.name)}</a>'
+                    f" - {html.escape(note.teacher.lesson.name)}"
+                )
+                for page, snippet in pages:
+                    lines.append(f"   صفحه {page}: {html.escape(snippet)}")
+                lines.append("")
+            if not results:
+                lines.append("جزوه‌ای با این عبارت پیدا نشد.")
+
+        # Whole lines only; cutting the markup could split a tag or an entity
+        text = lines[0]
+        for line in lines[1:]:
+            if len(text) + 1 + len(line) > MAX_REPLY_LENGTH:
+                break
+            text += "\n" + line
+        await update.message.reply_text(text, parse_mode='HTML', disable_web_page_preview=True)
+
+    async def about(self, update: Update, context: CallbackContext, nav: Nav) -> None:
         """Show about information."""
         query = update.callback_query
         await query.answer()
@@ -510,16 +735,16 @@ class TelegramBotHandlers:
             "امکانات:\n"
             "• مرور جزوه‌ها بر اساس رشته، نیمسال و درس\n"
             "• امتیازدهی به جزوه‌ها برای کمک به دیگران در یافتن محتوای با کیفیت\n"
-            "• دریافت اعلان برای جزوه‌های جدید\n\n"
+            "• دریافت اعلان برای جزوه‌های جدید\n"
+            "• جستجو در متن جزوه‌ها با دستور /search\n\n"
             "ساخته شده با ❤️ توسط V, برای شما عزیزان"
         )
 
-        keyboard = [[InlineKeyboardButton("🔙 بازگشت به منو", callback_data='back')]]
+        keyboard = [[self._button("🔙 بازگشت به منو", Nav(navigation.HOME))]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         await query.message.edit_text(
             about_text,
             reply_markup=reply_markup,
             parse_mode='Markdown'
-        )
-        return CHOOSING 
\ No newline at end of file
+        ) 
\ No newline at end of file
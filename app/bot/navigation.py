@@ -0,0 +1,145 @@
+import base64
+import hashlib
+import hmac
+
+# Telegram rejects buttons whose callback_data is longer than this
+MAX_CALLBACK_BYTES = 64
+
+# Screens, one character each to keep callback_data short
+HOME = 'h'
+MAJORS = 'b'
+SEMESTERS = 'm'
+LESSONS = 's'
+TEACHERS = 'l'
+NOTES = 't'
+SUBSCRIBE = 'u'
+UNSUBSCRIBE = 'x'
+LESSON_TOP = 'd'
+TOP_DOWNLOADS = 'D'
+TOP_RATED = 'r'
+TRENDING = 'R'
+ABOUT = 'a'
+TOGGLE_DIGEST = 'g'
+RATE = 'v'
+BUNDLE = 'z'
+
+# The browse hierarchy: each list screen and the path field it is keyed by
+HIERARCHY = (
+    (MAJORS, None),
+    (SEMESTERS, 'major_id'),
+    (LESSONS, 'semester_id'),
+    (TEACHERS, 'lesson_id'),
+    (NOTES, 'teacher_id')
+)
+
+# Encoded after the screen, in this order; trailing empty fields are dropped
+FIELDS = ('major_id', 'semester_id', 'lesson_id', 'teacher_id', 'note_id', 'value')
+
+SIGNATURE_BYTES = 6
+
+def _to_base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    if number == 0:
+        return '0'
+    out = ''
+    while number:
+        number, rest = divmod(number, 36)
+        out = digits[rest] + out
+    return out
+
+class Nav:
+    """A screen plus the browse path (and page) that leads to it."""
+    __slots__ = ('view', 'page') + FIELDS
+
+    def __init__(self, view, page=None, **path):
+        self.view = view
+        self.page = page
+        for field in FIELDS:
+            setattr(self, field, path.pop(field, None))
+        if path:
+            raise TypeError(f"Unknown navigation fields: {', '.join(path)}")
+
+    def to(self, view, page=None, **changes):
+        """The same path on another screen, changing the given fields."""
+        path = {field: getattr(self, field) for field in FIELDS}
+        path.update(changes)
+        return Nav(view, page, **path)
+
+    def scope(self):
+        """The deepest list screen on the path and the field keying it, or None.
+
+        A subscription toggle subscribes to this level and returns to its screen.
+        """
+        for view, key in reversed(HIERARCHY):
+            if key is not None and getattr(self, key) is not None:
+                return view, key
+        return None
+
+    def back(self):
+        """The list screen one level above this one, or the main menu."""
+        levels = [view for view, _ in HIERARCHY]
+        if self.view in levels:
+            index = levels.index(self.view) - 1
+        elif self.view in (SUBSCRIBE, UNSUBSCRIBE) and self.scope():
+            index = levels.index(self.scope()[0]) - 1
+        elif self.view in (LESSON_TOP, BUNDLE):
+            index = levels.index(TEACHERS)
+        else:
+            return Nav(HOME)
+        # Skip levels whose id is not on the path, e.g. after a deep link
+        while index >= 0:
+            view, key = HIERARCHY[index]
+            if key is None or getattr(self, key) is not None:
+                return self.to(view, **{deeper: None for _, deeper in HIERARCHY[index + 1:]})
+            index -= 1
+        return Nav(HOME)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__[1:] if getattr(self, name) is not None)
+        return f'Nav({self.view!r}{", " if fields else ""}{fields})'
+
+class CallbackCodec:
+    """Packs a Nav into signed callback_data and back.
+
+    The payload is the screen character followed by base36 path fields
+    and an optional page token, separated by colons, e.g.
+    `t:3:c:1f:7:::nb2`. A truncated HMAC over the payload is appended,
+    so any bot worker sharing the secret can render the screen from the
+    button alone, and forged or outdated buttons decode to None.
+    """
+
+    def __init__(self, secret):
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        self._key = hashlib.sha256(b'callback-data:' + secret).digest()
+
+    def _sign(self, payload):
+        digest = hmac.new(self._key, payload.encode('utf-8'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).decode('ascii')
+
+    def encode(self, nav):
+        fields = [nav.view]
+        fields.extend('' if getattr(nav, field) is None else _to_base36(getattr(nav, field)) for field in FIELDS)
+        fields.append(f'{nav.page[0]}{_to_base36(int(nav.page[1:]))}' if nav.page else '')
+        payload = ':'.join(fields).rstrip(':')
+        data = f'{payload}~{self._sign(payload)}'
+        if len(data.encode('utf-8')) > MAX_CALLBACK_BYTES:
+            raise ValueError(f"callback_data too long: {data}")
+        return data
+
+    def decode(self, data):
+        """Return the Nav encoded in `data`, or None if it is not valid signed callback_data."""
+        payload, _, signature = (data or '').rpartition('~')
+        if not payload or not hmac.compare_digest(signature.encode('utf-8'), self._sign(payload).encode('ascii')):
+            return None
+
+        view, *values = payload.split(':')
+        values += [''] * (len(FIELDS) + 1 - len(values))
+        try:
+            path = {field: int(value, 36) if value else None for field, value in zip(FIELDS, values)}
+            page = values[len(FIELDS)]
+            if page:
+                page = f'{page[0]}{int(page[1:], 36)}'
+        except (ValueError, IndexError):
+            return None
+        return Nav(view, page or None, **path)
@@ -0,0 +1,75 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from app.utils import metrics
+
+class _ChatLock:
+    __slots__ = ('lock', 'users')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently, but one at a time per chat and in arrival order.
+
+    A slow handler (such as a 60 second send_document) only delays later
+    updates from the same chat. Updates waiting behind their own chat do
+    not hold one of the `max_concurrent_updates` slots, so one busy user
+    cannot starve everybody else. Locks exist only while a chat has
+    updates in flight, so memory stays bounded by the number of active
+    chats.
+
+    When a `profiler` is given, each update is timed by it end to end.
+    """
+
+    def __init__(self, max_concurrent_updates, profiler=None):
+        super().__init__(max_concurrent_updates)
+        self._chats = {}
+        self.profiler = profiler
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        # Overrides the base implementation so the per-chat lock is taken
+        # before a concurrency slot; asyncio.Lock wakes waiters in FIFO order
+        key = self._key(update)
+        if key is None:
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+            return
+
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = _ChatLock()
+        chat.users += 1
+        try:
+            async with chat.lock:
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            chat.users -= 1
+            if not chat.users:
+                del self._chats[key]
+        metrics.set_gauge('bot_active_chats', len(self._chats))
+
+    async def do_process_update(self, update, coroutine):
+        if self.profiler is None:
+            await coroutine
+        else:
+            await self.profiler.profile(update, coroutine)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
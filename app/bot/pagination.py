@@ -0,0 +1,69 @@
+from sqlalchemy import tuple_
+from telegram import InlineKeyboardButton
+
+def parse_cursor(token):
+    """Turn a page token like 'n12' or 'p12' into (direction, id); None is the first page."""
+    if not token or token[0] not in 'np':
+        return None
+    try:
+        return token[0], int(token[1:])
+    except ValueError:
+        return None
+
+def fetch_page(query, column, cursor, page_size, rank=None):
+    """Fetch one keyset page of `query` ordered by `column`.
+
+    With `rank`, rows are ordered by (rank, column) descending instead and
+    the cursor row's rank is looked up by primary key, so page tokens stay
+    short. Returns (items, prev_token, next_token). Only page_size + 1 rows
+    are read from an index range scan, so the cost does not grow with the
+    list length.
+    """
+    if rank is None:
+        forward, backward = (column.asc(),), (column.desc(),)
+    else:
+        forward, backward = (rank.desc(), column.desc()), (rank.asc(), column.asc())
+
+    if cursor is None:
+        rows = query.order_by(*forward).limit(page_size + 1).all()
+        items = rows[:page_size]
+        prev_token = None
+        next_token = f'n{items[-1].id}' if len(rows) > page_size else None
+        return items, prev_token, next_token
+
+    direction, value = cursor
+    if rank is None:
+        after, before = column > value, column < value
+    else:
+        cursor_rank = query.with_entities(rank).filter(column == value).scalar()
+        key, bound = tuple_(rank, column), tuple_(cursor_rank, value)
+        after, before = key < bound, key > bound
+
+    if direction == 'n':
+        rows = query.filter(after).order_by(*forward).limit(page_size + 1).all()
+        items = rows[:page_size]
+        has_prev, has_next = True, len(rows) > page_size
+    else:
+        rows = query.filter(before).order_by(*backward).limit(page_size + 1).all()
+        items = list(reversed(rows[:page_size]))
+        has_prev, has_next = len(rows) > page_size, True
+
+    if not items:
+        # The page vanished (items deleted); start over from the first page
+        return fetch_page(query, column, None, page_size, rank)
+
+    prev_token = f'p{items[0].id}' if has_prev else None
+    next_token = f'n{items[-1].id}' if has_next else None
+    return items, prev_token, next_token
+
+def page_buttons(callback_data, prev_token, next_token):
+    """Return a keyboard row with previous/next buttons, or None for a single page.
+
+    `callback_data` turns a page token into the button's callback data.
+    """
+    row = []
+    if prev_token:
+        row.append(InlineKeyboardButton("« قبلی", callback_data=callback_data(prev_token)))
+    if next_token:
+        row.append(InlineKeyboardButton("بعدی »", callback_data=callback_data(next_token)))
+    return row or None
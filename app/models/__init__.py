@@ -1,4 +1,4 @@
-from .database import Admin, Note, Major, Semester, Lesson, Teacher, Rating, Subscription, User
+from .database import Admin, Note, Major, Semester, Lesson, Teacher, Rating, Subscription, User, BroadcastJob, PendingNotification, NoteDownloadStat, AnalyticsRollup, AnalyticsWatermark, NotePage, LessonBundle, CatalogChange
 
-__all__ = ['Admin', 'Note', 'Major', 'Semester', 'Lesson', 'Teacher', 'Rating', 'Subscription', 'User']
+__all__ = ['Admin', 'Note', 'Major', 'Semester', 'Lesson', 'Teacher', 'Rating', 'Subscription', 'User', 'BroadcastJob', 'PendingNotification', 'NoteDownloadStat', 'AnalyticsRollup', 'AnalyticsWatermark', 'NotePage', 'LessonBundle', 'CatalogChange']
 
@@ -1,6 +1,8 @@
+import os
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from sqlalchemy import DDL, event
 from .. import db
 
 class User(db.Model):
@@ -8,12 +10,14 @@ class User(db.Model):
     telegram_id = db.Column(db.Integer, unique=True)
     username = db.Column(db.String(64))
     join_date = db.Column(db.DateTime, default=datetime.utcnow)
-    last_active = db.Column(db.DateTime)
-    is_blocked = db.Column(db.Boolean, default=False)
+    last_active = db.Column(db.DateTime, index=True)
+    is_blocked = db.Column(db.Boolean, default=False, index=True)
     block_reason = db.Column(db.Text)
+    block_updated = db.Column(db.DateTime, index=True)  # When is_blocked last changed
     notes_viewed = db.Column(db.Integer, default=0)
     total_ratings = db.Column(db.Integer, default=0)
     avg_rating = db.Column(db.Float, default=0.0)
+    digest_mode = db.Column(db.Boolean, default=False)  # Coalesce new-note notifications
     subscriptions = db.relationship('Subscription', backref='user', lazy='dynamic')
     ratings = db.relationship('Rating', backref='user', lazy='dynamic')
 
@@ -55,20 +59,20 @@ class Major(db.Model):
 class Semester(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
-    major_id = db.Column(db.Integer, db.ForeignKey('major.id'))
+    major_id = db.Column(db.Integer, db.ForeignKey('major.id'), index=True)
     lessons = db.relationship('Lesson', backref='semester', lazy='dynamic')
 
 class Lesson(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
-    semester_id = db.Column(db.Integer, db.ForeignKey('semester.id'))
+    semester_id = db.Column(db.Integer, db.ForeignKey('semester.id'), index=True)
     teachers = db.relationship('Teacher', backref='lesson', lazy='dynamic')
     subscriptions = db.relationship('Subscription', backref='lesson', lazy='dynamic')
 
 class Teacher(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
-    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'))
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), index=True)
     notes = db.relationship('Note', backref='teacher', lazy='dynamic')
 
 class Note(db.Model):
@@ -79,15 +83,39 @@ class Note(db.Model):
     description = db.Column(db.Text)
     file_path = db.Column(db.String(256), nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
-    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'))
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), index=True)
     rating_sum = db.Column(db.Integer, default=0)  # Sum of all ratings
     rating_count = db.Column(db.Integer, default=0)  # Number of ratings
+    download_count = db.Column(db.Integer, default=0)  # Flushed in batches from memory
+    bayesian_score = db.Column(db.Float, index=True)  # Maintained by app.utils.ranking
+    trending_score = db.Column(db.Float, default=0.0, index=True)  # Log of decayed activity
+    optimized_path = db.Column(db.String(256))  # Smaller copy made by app.utils.pdf_optimize
+    original_size = db.Column(db.Integer)
+    optimized_size = db.Column(db.Integer)
+    text_pages = db.Column(db.Integer)  # Pages indexed by app.utils.fulltext; None until extracted
+    content_hash = db.Column(db.String(64))  # SHA-256 of file_path for ETags; cleared when the file is replaced
     ratings = db.relationship('Rating', backref='note', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('ix_note_teacher_rank', 'teacher_id', db.text('coalesce(bayesian_score, 0)'), 'id'),  # ranking.listing_rank()
+    )
+
     @property
     def average_rating(self):
         return self.rating_sum / self.rating_count if self.rating_count > 0 else 0
 
+    @property
+    def delivery_path(self):
+        """The file to send to students: the optimized copy when one exists, else the original."""
+        if self.optimized_path and os.path.exists(self.optimized_path):
+            return self.optimized_path
+        return self.file_path
+
+class NoteDownloadStat(db.Model):
+    note_id = db.Column(db.Integer, db.ForeignKey('note.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    count = db.Column(db.Integer, default=0)
+
 class Rating(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     value = db.Column(db.Integer, nullable=False)
@@ -97,7 +125,81 @@ class Rating(db.Model):
     note_id = db.Column(db.Integer, db.ForeignKey('note.id'))
 
 class Subscription(db.Model):
+    # Exactly one scope column is set; a scope covers every note below it
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'))
-    date_subscribed = db.Column(db.DateTime, default=datetime.utcnow) 
\ No newline at end of file
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    major_id = db.Column(db.Integer, db.ForeignKey('major.id'), index=True)
+    semester_id = db.Column(db.Integer, db.ForeignKey('semester.id'), index=True)
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), index=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), index=True)
+    date_subscribed = db.Column(db.DateTime, default=datetime.utcnow)
+    pending_notifications = db.relationship('PendingNotification', backref='subscription', lazy='dynamic')
+
+class PendingNotification(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), index=True)
+    note_id = db.Column(db.Integer, db.ForeignKey('note.id'), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BroadcastJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    message = db.Column(db.Text, nullable=False)
+    audience = db.Column(db.String(32), nullable=False)  # all, active, lesson, not_blocked, selected
+    audience_value = db.Column(db.Text)  # Days, lesson id or comma separated user ids
+    status = db.Column(db.String(16), default='pending')  # pending, running, done, failed
+    total = db.Column(db.Integer, default=0)
+    sent = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    last_telegram_id = db.Column(db.Integer)  # Audience cursor; a resumed job continues after it
+    heartbeat = db.Column(db.DateTime)  # Last progress commit by the process sending the job
+
+    @property
+    def remaining(self):
+        return max((self.total or 0) - (self.sent or 0) - (self.failed or 0), 0)
+
+class AnalyticsRollup(db.Model):
+    metric = db.Column(db.String(32), primary_key=True)  # active_users, new_users, downloads, ratings, subscriptions
+    period = db.Column(db.String(8), primary_key=True)  # hour, day
+    dimension = db.Column(db.String(16), primary_key=True)  # all, lesson, major
+    dimension_id = db.Column(db.Integer, primary_key=True, default=0)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    value = db.Column(db.Integer, default=0)
+
+class AnalyticsWatermark(db.Model):
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, default=0)  # Last processed id, or date ordinal for daily sources
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class LessonBundle(db.Model):
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), primary_key=True)
+    path = db.Column(db.String(256), nullable=False)  # ZIP of the lesson's notes built by app.utils.bundles
+    fingerprint = db.Column(db.String(40), nullable=False)  # Digest of the notes the ZIP was built from
+    size = db.Column(db.BigInteger)
+    note_count = db.Column(db.Integer)
+    built_at = db.Column(db.DateTime, default=datetime.utcnow)
+    telegram_file_id = db.Column(db.String(256))  # Set after the first upload; resent without uploading
+
+class CatalogChange(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # The catalog version; app.utils.changes polls it
+    scope = db.Column(db.String(16), nullable=False)  # taxonomy, lesson
+    scope_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class NotePage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    note_id = db.Column(db.Integer, db.ForeignKey('note.id'), index=True)
+    page = db.Column(db.Integer, nullable=False)  # 1-based
+    text = db.Column(db.Text)  # Normalized text layer of the page
+
+# On SQLite note_page is mirrored into an FTS5 index kept in step by triggers
+for statement in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS note_page_fts USING fts5("
+    "text, content='note_page', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS note_page_ai AFTER INSERT ON note_page BEGIN "
+    "INSERT INTO note_page_fts(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS note_page_ad AFTER DELETE ON note_page BEGIN "
+    "INSERT INTO note_page_fts(note_page_fts, rowid, text) VALUES ('delete', old.id, old.text); END"
+):
+    event.listen(NotePage.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+
+from sqlalchemy import select, func, null
+from sqlalchemy.dialects.sqlite import insert
+
+from ..models.database import (
+    db, User, Note, Teacher, Lesson, Semester, Rating, Subscription,
+    NoteDownloadStat, AnalyticsRollup, AnalyticsWatermark
+)
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('active_users', 'new_users', 'downloads', 'ratings', 'subscriptions')
+
+def _hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def _day(value):
+    if isinstance(value, datetime):
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return datetime.combine(value, datetime.min.time())
+
+def _watermark(name):
+    mark = AnalyticsWatermark.query.get(name)
+    if not mark:
+        mark = AnalyticsWatermark(name=name, value=0)
+        db.session.add(mark)
+    return mark
+
+def _merge(rows, mode):
+    """Write {(metric, period, dimension, dimension_id, bucket): value} into the rollup table.
+
+    `mode` is 'add' for counts of new events, 'replace' for buckets that are
+    recomputed from a mutable source and 'max' for gauges sampled over time.
+    Every row is one upsert on the primary key, sent as a single executemany,
+    so there is no lookup of existing buckets and no bind-variable limit.
+    """
+    if not rows:
+        return
+    table = AnalyticsRollup.__table__
+    statement = insert(table)
+    if mode == 'add':
+        value = table.c.value + statement.excluded.value
+    elif mode == 'max':
+        value = func.max(table.c.value, statement.excluded.value)
+    else:
+        value = statement.excluded.value
+    db.session.execute(
+        statement.on_conflict_do_update(index_elements=list(table.primary_key.columns), set_={'value': value}),
+        [
+            {
+                'metric': metric, 'period': period, 'dimension': dimension,
+                'dimension_id': dimension_id, 'bucket': bucket, 'value': count
+            }
+            for (metric, period, dimension, dimension_id, bucket), count in rows.items()
+        ]
+    )
+
+def _count_events(metric, rows, hourly=True):
+    """Bucket (timestamp, lesson_id, major_id) rows into hourly/daily counts per dimension."""
+    counts = defaultdict(int)
+    for timestamp, lesson_id, major_id in rows:
+        if timestamp is None:
+            continue
+        buckets = [('day', _day(timestamp))]
+        if hourly:
+            buckets.append(('hour', _hour(timestamp)))
+        for period, bucket in buckets:
+            counts[(metric, period, 'all', 0, bucket)] += 1
+            if lesson_id is not None:
+                counts[(metric, period, 'lesson', lesson_id, bucket)] += 1
+            if major_id is not None:
+                counts[(metric, period, 'major', major_id, bucket)] += 1
+    return counts
+
+def _rollup_events(metric, id_column, query, batch_size=5000):
+    """Roll up rows of an append-only table whose ids are newer than the watermark."""
+    mark = _watermark(metric)
+    processed = 0
+    while True:
+        rows = db.session.execute(
+            query.where(id_column > mark.value).order_by(id_column).limit(batch_size)
+        ).all()
+        if not rows:
+            return processed
+        _merge(_count_events(metric, [row[1:] for row in rows]), 'add')
+        mark.value = rows[-1][0]
+        mark.updated_at = datetime.utcnow()
+        processed += len(rows)
+
+def rollup_new_users():
+    query = select(User.id, User.join_date, null(), null())
+    return _rollup_events('new_users', User.id, query)
+
+def rollup_ratings():
+    query = (
+        select(Rating.id, Rating.date, Lesson.id, Semester.major_id)
+        .join(Note, Note.id == Rating.note_id)
+        .join(Teacher, Teacher.id == Note.teacher_id)
+        .join(Lesson, Lesson.id == Teacher.lesson_id)
+        .outerjoin(Semester, Semester.id == Lesson.semester_id)
+    )
+    return _rollup_events('ratings', Rating.id, query)
+
+def rollup_subscriptions():
+    # Only the scope column is set, so resolve the lesson and major it sits under;
+    # major and semester subscriptions count towards their major alone
+    query = (
+        select(
+            Subscription.id, Subscription.date_subscribed, Lesson.id,
+            func.coalesce(Subscription.major_id, Semester.major_id)
+        )
+        .outerjoin(Teacher, Teacher.id == Subscription.teacher_id)
+        .outerjoin(Lesson, Lesson.id == func.coalesce(Subscription.lesson_id, Teacher.lesson_id))
+        .outerjoin(Semester, Semester.id == func.coalesce(Subscription.semester_id, Lesson.semester_id))
+    )
+    return _rollup_events('subscriptions', Subscription.id, query)
+
+def rollup_downloads():
+    """Recompute daily download buckets from the last processed day onwards."""
+    mark = _watermark('downloads')
+    since = date.fromordinal(mark.value) if mark.value else date.min
+    rows = db.session.execute(
+        select(NoteDownloadStat.day, Lesson.id, Semester.major_id, func.sum(NoteDownloadStat.count))
+        .join(Note, Note.id == NoteDownloadStat.note_id)
+        .join(Teacher, Teacher.id == Note.teacher_id)
+        .join(Lesson, Lesson.id == Teacher.lesson_id)
+        .outerjoin(Semester, Semester.id == Lesson.semester_id)
+        .where(NoteDownloadStat.day >= since)
+        .group_by(NoteDownloadStat.day, Lesson.id, Semester.major_id)
+    ).all()
+
+    counts = defaultdict(int)
+    for day, lesson_id, major_id, count in rows:
+        bucket = _day(day)
+        counts[('downloads', 'day', 'all', 0, bucket)] += count
+        counts[('downloads', 'day', 'lesson', lesson_id, bucket)] += count
+        if major_id is not None:
+            counts[('downloads', 'day', 'major', major_id, bucket)] += count
+    _merge(counts, 'replace')
+
+    # Today's bucket is still filling up, so the next run starts from it again
+    mark.value = date.today().toordinal()
+    mark.updated_at = datetime.utcnow()
+    return len(rows)
+
+def rollup_active_users():
+    """Sample daily active users from User.last_active.
+
+    Only the latest activity is stored per user, so each run counts users
+    last seen in every day since the previous run and keeps the highest
+    count seen for that day.
+    """
+    mark = _watermark('active_users')
+    today = datetime.utcnow().date()  # last_active is stored in UTC
+    first = date.fromordinal(mark.value) if mark.value else today
+
+    counts = {}
+    day = first
+    while day <= today:
+        start = _day(day)
+        query = User.query.filter(User.last_active >= start)
+        if day < today:
+            query = query.filter(User.last_active < start + timedelta(days=1))
+        counts[('active_users', 'day', 'all', 0, start)] = query.count()
+        day += timedelta(days=1)
+    _merge(counts, 'max')
+
+    mark.value = today.toordinal()
+    mark.updated_at = datetime.utcnow()
+    return len(counts)
+
+def run_rollups():
+    """Bring every rollup up to date in one transaction; requires an app context."""
+    try:
+        processed = {
+            'new_users': rollup_new_users(),
+            'ratings': rollup_ratings(),
+            'subscriptions': rollup_subscriptions(),
+            'downloads': rollup_downloads(),
+            'active_users': rollup_active_users()
+        }
+        db.session.commit()
+        return processed
+    except Exception:
+        db.session.rollback()
+        raise
+
+def series(metric, period='day', dimension='all', dimension_id=0, since=None, until=None):
+    """Return [(bucket, value)] for one chart, served by the rollup primary key."""
+    query = AnalyticsRollup.query.filter_by(
+        metric=metric, period=period, dimension=dimension, dimension_id=dimension_id
+    )
+    if since:
+        query = query.filter(AnalyticsRollup.bucket >= since)
+    if until:
+        query = query.filter(AnalyticsRollup.bucket < until)
+    return [(row.bucket, row.value) for row in query.order_by(AnalyticsRollup.bucket)]
+
+async def run_rollup_scheduler(app):
+    """Periodically update the analytics rollups until cancelled."""
+    while True:
+        try:
+            with app.app_context():
+                run_rollups()
+        except Exception as e:
+            logger.error(f"Error updating analytics rollups: {e}")
+        await asyncio.sleep(app.config['ANALYTICS_ROLLUP_INTERVAL'])
@@ -0,0 +1,265 @@
+import io
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+from datetime import datetime, date
+
+from flask import current_app
+from sqlalchemy import Date, DateTime
+
+from ..models.database import db
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+LAST_MANIFEST = 'last_manifest.json'
+CHUNK_SIZE = 64 * 1024
+
+def _is_sqlite():
+    return db.engine.url.get_backend_name() == 'sqlite'
+
+def snapshot_database(directory):
+    """Write a consistent copy of the live database into `directory`; requires an app context.
+
+    SQLite is copied page by page with its online backup API while the bot
+    keeps writing. Other databases are dumped table by table as JSON lines
+    inside one REPEATABLE READ transaction. Returns the written paths.
+    """
+    if _is_sqlite():
+        path = os.path.join(directory, 'database.sqlite3')
+        source = db.engine.raw_connection()
+        target = sqlite3.connect(path)
+        try:
+            source.driver_connection.backup(target)
+        finally:
+            target.close()
+            source.close()
+        return [path]
+
+    paths = []
+    with db.engine.connect().execution_options(isolation_level='REPEATABLE READ') as connection:
+        with connection.begin():
+            for table in db.metadata.sorted_tables:
+                path = os.path.join(directory, f'{table.name}.jsonl')
+                with open(path, 'w', encoding='utf-8') as out:
+                    result = connection.execution_options(stream_results=True, yield_per=1000).execute(table.select())
+                    for row in result.mappings():
+                        out.write(json.dumps(dict(row), default=_json_default, ensure_ascii=False) + '\n')
+                paths.append(path)
+    return paths
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+def scan_uploads(upload_folder):
+    """Return {relative_path: [size, mtime]} for every file in the upload folder."""
+    files = {}
+    for root, folders, names in os.walk(upload_folder):
+        # Skip hidden folders such as unfinished resumable uploads
+        folders[:] = [folder for folder in folders if not folder.startswith('.')]
+        for name in names:
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            files[os.path.relpath(path, upload_folder)] = [stat.st_size, int(stat.st_mtime)]
+    return files
+
+def load_manifest(backup_folder):
+    """Return the manifest of the previous export, or None."""
+    path = os.path.join(backup_folder, LAST_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def write_archive(out, snapshot_paths, upload_folder, previous=None):
+    """Stream the snapshot and uploads into a gzip tar written to the file object `out`.
+
+    Files are copied from disk in chunks by tarfile, so nothing is held in
+    memory. With a previous manifest only new or changed uploads are added.
+    Returns the manifest describing this archive.
+    """
+    files = scan_uploads(upload_folder)
+    previous_files = (previous or {}).get('files', {})
+    changed = [path for path, info in files.items() if previous_files.get(path) != info]
+    manifest = {
+        'created_at': datetime.utcnow().isoformat(),
+        'incremental': previous is not None,
+        'base': previous.get('created_at') if previous else None,
+        'files': files,
+        'included': changed
+    }
+
+    with tarfile.open(fileobj=out, mode='w|gz') as tar:
+        for path in snapshot_paths:
+            tar.add(path, arcname=f'database/{os.path.basename(path)}')
+        for path in changed:
+            tar.add(os.path.join(upload_folder, path), arcname=f'uploads/{path}')
+
+        data = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        info.mtime = int(datetime.utcnow().timestamp())
+        tar.addfile(info, io.BytesIO(data))
+    return manifest
+
+def save_manifest(backup_folder, manifest):
+    os.makedirs(backup_folder, exist_ok=True)
+    path = os.path.join(backup_folder, LAST_MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+def _archive(out, workdir, snapshot_paths, previous):
+    """Write the archive of a snapshot taken into `workdir`, then remove it; returns the manifest."""
+    try:
+        return write_archive(out, snapshot_paths, current_app.config['UPLOAD_FOLDER'], previous)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _take_snapshot(incremental):
+    """Snapshot the database into a new work directory; returns what `_archive` needs after `out`."""
+    previous = load_manifest(current_app.config['BACKUP_FOLDER']) if incremental else None
+    workdir = tempfile.mkdtemp(prefix='backup-')
+    try:
+        return workdir, snapshot_database(workdir), previous
+    except Exception:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+
+def export_backup(out, incremental=False):
+    """Snapshot the database and stream a full or incremental backup into `out`.
+
+    The manifest becomes the base of the next incremental backup only once
+    the whole archive has been written.
+    """
+    manifest = _archive(out, *_take_snapshot(incremental))
+    save_manifest(current_app.config['BACKUP_FOLDER'], manifest)
+    return manifest
+
+def stream_backup(incremental=False):
+    """Return an iterator of backup chunks for an HTTP response; requires an app context.
+
+    The database is snapshotted before this returns, so its failures still
+    become an error response. The archive is then written by a helper
+    thread into a pipe, so memory use stays at one chunk. A failure while
+    writing is raised from the iterator, which makes the server abort the
+    connection instead of ending a truncated archive normally. The manifest
+    is saved only after the last chunk was handed to the server, so an
+    aborted download never moves the incremental base forward.
+    """
+    app = current_app._get_current_object()
+    snapshot = _take_snapshot(incremental)
+    read_fd, write_fd = os.pipe()
+    manifests, failures = [], []
+
+    def produce():
+        with app.app_context(), os.fdopen(write_fd, 'wb') as out:
+            try:
+                manifests.append(_archive(out, *snapshot))
+            except Exception as e:
+                logger.error(f"Error writing backup: {e}")
+                # Recorded before the pipe closes, so the reader sees it at end of file
+                failures.append(e)
+
+    def consume():
+        with os.fdopen(read_fd, 'rb') as source:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        if failures:
+            raise failures[0]
+        save_manifest(app.config['BACKUP_FOLDER'], manifests[0])
+
+    threading.Thread(target=produce, name='backup-export', daemon=True).start()
+    return consume()
+
+def _safe_target(base, name):
+    target = os.path.realpath(os.path.join(base, name))
+    if not target.startswith(os.path.realpath(base) + os.sep):
+        raise ValueError(f"Refusing to extract outside {base}: {name}")
+    return target
+
+def _restore_sqlite(fileobj):
+    fd, path = tempfile.mkstemp(suffix='.sqlite3')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            shutil.copyfileobj(fileobj, out, CHUNK_SIZE)
+        source = sqlite3.connect(path)
+        target = db.engine.raw_connection()
+        try:
+            source.backup(target.driver_connection)
+        finally:
+            target.close()
+            source.close()
+        db.engine.dispose()
+    finally:
+        os.remove(path)
+
+def _restore_table(name, fileobj):
+    table = db.metadata.tables[name]
+    converters = {}
+    for column in table.columns:
+        if isinstance(column.type, DateTime):
+            converters[column.name] = datetime.fromisoformat
+        elif isinstance(column.type, Date):
+            converters[column.name] = date.fromisoformat
+
+    with db.engine.begin() as connection:
+        batch = []
+        for line in io.TextIOWrapper(fileobj, encoding='utf-8'):
+            row = json.loads(line)
+            for column, convert in converters.items():
+                if row.get(column) is not None:
+                    row[column] = convert(row[column])
+            batch.append(row)
+            if len(batch) >= 1000:
+                connection.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(table.insert(), batch)
+
+def restore_backup(path):
+    """Restore a backup archive into the configured database and upload folder.
+
+    Apply the full archive first, then each incremental archive in order.
+    Returns the archive's manifest.
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    os.makedirs(upload_folder, exist_ok=True)
+    manifest = None
+    tables_cleared = False
+
+    with tarfile.open(path, mode='r|gz') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            source = tar.extractfile(member)
+            if member.name == MANIFEST_NAME:
+                manifest = json.load(source)
+            elif member.name == 'database/database.sqlite3':
+                _restore_sqlite(source)
+            elif member.name.startswith('database/') and member.name.endswith('.jsonl'):
+                if not tables_cleared:
+                    # Children first so foreign keys never point at deleted rows
+                    with db.engine.begin() as connection:
+                        for table in reversed(db.metadata.sorted_tables):
+                            connection.execute(table.delete())
+                    tables_cleared = True
+                _restore_table(os.path.basename(member.name)[:-len('.jsonl')], source)
+            elif member.name.startswith('uploads/'):
+                target = _safe_target(upload_folder, member.name[len('uploads/'):])
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target + '.part', 'wb') as out:
+                    shutil.copyfileobj(source, out, CHUNK_SIZE)
+                os.replace(target + '.part', target)
+                os.utime(target, (member.mtime, member.mtime))
+    return manifest
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from ..models.database import db, User
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+class Blocklist:
+    """Telegram ids of blocked users, held in memory so the bot can drop their updates without a query.
+
+    load() reads the whole set once. refresh() then reads only users whose
+    block state changed after the last watermark, less `overlap` seconds so
+    changes committed late by another process are not missed. set_blocked()
+    applies a change in its own process at once; other bot workers see it
+    on their next refresh.
+    """
+
+    def __init__(self, overlap=60):
+        self.overlap = overlap
+        self._ids = frozenset()
+        self._watermark = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, telegram_id):
+        # The set is replaced, never mutated, so lookups need no lock
+        return telegram_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _publish(self, ids, watermark):
+        self._ids = frozenset(ids)
+        self._watermark = watermark
+        metrics.set_gauge('blocked_users', len(self._ids))
+
+    def load(self):
+        """Read every blocked telegram id from the database."""
+        ids = db.session.query(User.telegram_id).filter(User.is_blocked.is_(True)).all()
+        watermark = db.session.query(func.max(User.block_updated)).scalar()
+        with self._lock:
+            self._publish({telegram_id for (telegram_id,) in ids}, watermark or datetime.utcnow())
+
+    def refresh(self):
+        """Apply block and unblock changes made since the last load or refresh."""
+        if self._watermark is None:
+            return self.load()
+
+        since = self._watermark - timedelta(seconds=self.overlap)
+        rows = db.session.query(User.telegram_id, User.is_blocked, User.block_updated).filter(
+            User.block_updated > since
+        ).all()
+        if not rows:
+            return
+        with self._lock:
+            ids = set(self._ids)
+            watermark = self._watermark
+            for telegram_id, is_blocked, updated in rows:
+                if is_blocked:
+                    ids.add(telegram_id)
+                else:
+                    ids.discard(telegram_id)
+                watermark = max(watermark, updated)
+            self._publish(ids, watermark)
+
+    def set_blocked(self, user, blocked, reason=None):
+        """Block or unblock `user`, commit, and apply the change in this process."""
+        user.is_blocked = blocked
+        user.block_reason = reason if blocked else None
+        user.block_updated = datetime.utcnow()
+        db.session.commit()
+        with self._lock:
+            ids = set(self._ids)
+            if blocked:
+                ids.add(user.telegram_id)
+            else:
+                ids.discard(user.telegram_id)
+            self._publish(ids, self._watermark)
+
+blocklist = Blocklist()
+
+async def run_blocklist_refresher(app):
+    """Periodically pick up blocks made by other processes until cancelled."""
+    while True:
+        await asyncio.sleep(app.config['BLOCKLIST_REFRESH_SECONDS'])
+        try:
+            with app.app_context():
+                blocklist.refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing blocklist: {e}")
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import threading
+import zipfile
+from datetime import datetime
+
+from ..models.database import db, Note, Teacher, LessonBundle
+from . import metrics
+
+# Builds in progress in this process by (lesson id, fingerprint), so concurrent taps share one
+_building = {}
+
+def lesson_notes(lesson_id):
+    """The notes a lesson's bundle holds, in archive order; requires an app context."""
+    return (
+        Note.query.join(Teacher, Teacher.id == Note.teacher_id)
+        .filter(Teacher.lesson_id == lesson_id)
+        .order_by(Teacher.name, Note.id)
+        .all()
+    )
+
+def _arcname(note):
+    teacher = note.teacher.name.replace('/', '-').replace('\\', '-')
+    name = note.name.replace('/', '-').replace('\\', '-')
+    return f'{teacher}/{name} ({note.id}).pdf'
+
+def fingerprint(notes):
+    """Digest of everything a bundle's bytes depend on; any note added, edited or deleted changes it."""
+    digest = hashlib.sha1()
+    for note in notes:
+        path = note.delivery_path
+        try:
+            stat = os.stat(path)
+            version = f'{stat.st_size}:{stat.st_mtime_ns}'
+        except OSError:
+            version = 'missing'
+        digest.update(f'{note.id}\0{_arcname(note)}\0{path}\0{version}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+def content_size(notes):
+    """Bytes of the files a bundle of `notes` would hold; the archive adds little since nothing is recompressed."""
+    return sum(os.path.getsize(note.delivery_path) for note in notes if os.path.exists(note.delivery_path))
+
+def build_file(entries, target):
+    """Write the (arcname, path) files into a ZIP at `target`; runs in a worker thread.
+
+    PDFs barely compress, so members are stored and each file is streamed
+    into the archive in chunks rather than read whole. The archive is
+    written beside the target and renamed over it, so readers never see a
+    partial bundle. Returns the archive's size.
+    """
+    partial = f'{target}.{os.getpid()}.{threading.get_ident()}.part'
+    try:
+        with zipfile.ZipFile(partial, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for arcname, path in entries:
+                if not os.path.exists(path):
+                    continue
+                info = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+                with open(path, 'rb') as source, archive.open(info, 'w', force_zip64=True) as member:
+                    shutil.copyfileobj(source, member, 1024 * 1024)
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return os.path.getsize(target)
+
+def _remove(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def invalidate(lesson_id):
+    """Drop a lesson's bundle and its file so the next request rebuilds it; the caller commits."""
+    bundle = db.session.get(LessonBundle, lesson_id)
+    if bundle:
+        _remove(bundle.path)
+        db.session.delete(bundle)
+
+def _record(lesson_id, signature, path, size, note_count):
+    bundle = db.session.get(LessonBundle, lesson_id)
+    if bundle is None:
+        bundle = LessonBundle(lesson_id=lesson_id)
+        db.session.add(bundle)
+    elif bundle.path != path:
+        _remove(bundle.path)
+    bundle.path = path
+    bundle.fingerprint = signature
+    bundle.size = size
+    bundle.note_count = note_count
+    bundle.built_at = datetime.utcnow()
+    bundle.telegram_file_id = None
+    db.session.commit()
+    metrics.increment('bundles_built')
+    return bundle
+
+async def fetch(lesson_id, notes, folder):
+    """Return an up-to-date LessonBundle for `notes`, building it in a thread first if needed.
+
+    `notes` is the lesson's current `lesson_notes`. A cached bundle is
+    reused while its fingerprint still matches them, so changes made by
+    any process are noticed here even if nobody called `invalidate`.
+    Requires an app context.
+    """
+    signature = fingerprint(notes)
+    bundle = db.session.get(LessonBundle, lesson_id)
+    if bundle and bundle.fingerprint == signature and os.path.exists(bundle.path):
+        metrics.increment('bundle_cache_hits')
+        return bundle
+
+    key = (lesson_id, signature)
+    if key not in _building:
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'lesson-{lesson_id}-{signature[:12]}.zip')
+        entries = [(_arcname(note), note.delivery_path) for note in notes]
+        build = asyncio.get_running_loop().run_in_executor(None, build_file, entries, path)
+        build.add_done_callback(lambda _: _building.pop(key, None))
+        _building[key] = (build, path)
+    build, path = _building[key]
+    # Shielded so one impatient caller cannot cancel the build the others wait for
+    size = await asyncio.shield(build)
+
+    db.session.expire_all()
+    bundle = db.session.get(LessonBundle, lesson_id)
+    if bundle and bundle.fingerprint == signature and bundle.path == path:
+        # Another waiter on the same build recorded it first
+        return bundle
+    return _record(lesson_id, signature, path, size, len(notes))
+
+def remember_file_id(bundle, file_id):
+    """Keep Telegram's id for an uploaded bundle so later requests resend it without uploading."""
+    # Skipped if the bundle was rebuilt meanwhile, as the id belongs to the old archive
+    LessonBundle.query.filter_by(
+        lesson_id=bundle.lesson_id, fingerprint=bundle.fingerprint
+    ).update({'telegram_file_id': file_id})
+    db.session.commit()
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from ..models.database import db, CatalogChange
+
+logger = logging.getLogger(__name__)
+
+# Cache scopes a change can name; scope_id narrows 'lesson' to one lesson
+TAXONOMY = 'taxonomy'
+LESSON = 'lesson'
+
+def record(scope, scope_id=None):
+    """Log a catalog change for other processes; the caller commits it with the change itself."""
+    db.session.add(CatalogChange(scope=scope, scope_id=scope_id))
+
+class ChangeFeed:
+    """Tells in-memory caches in this process about catalog changes committed by any process.
+
+    Mutations add a CatalogChange row in their own transaction and the ids
+    form the version. poll() first reads the count and maximum of ids in a
+    small window above the last seen version, one indexed range scan. Only
+    when that differs does it read the new rows and call the listeners
+    registered for their scope. The window, `overlap` ids below the
+    version, catches ids that commit out of order.
+    """
+
+    def __init__(self, overlap=50):
+        self.overlap = overlap
+        self._listeners = defaultdict(list)
+        self._lock = threading.Lock()
+        self._version = None
+        self._window = None
+        self._seen = set()
+        self._polled_at = 0.0
+
+    def on(self, scope, callback):
+        """Call `callback(scope_id)` for every change to `scope`; scope_id is None for the whole scope."""
+        self._listeners[scope].append(callback)
+
+    def poll(self):
+        """Dispatch changes committed since the last poll; returns how many; requires an app context."""
+        with self._lock:
+            self._polled_at = time.monotonic()
+            if self._version is None:
+                # Nothing cached predates this process, so history needs no replay
+                self._version = db.session.query(func.max(CatalogChange.id)).scalar() or 0
+                self._seen = set(db.session.scalars(
+                    select(CatalogChange.id).where(CatalogChange.id > self._version - self.overlap)
+                ))
+                self._window = (len(self._seen), max(self._seen, default=None))
+                return 0
+
+            floor = self._version - self.overlap
+            window = tuple(db.session.query(func.count(CatalogChange.id), func.max(CatalogChange.id)).filter(
+                CatalogChange.id > floor
+            ).one())
+            if window == self._window:
+                return 0
+
+            rows = db.session.query(CatalogChange.id, CatalogChange.scope, CatalogChange.scope_id).filter(
+                CatalogChange.id > floor
+            ).order_by(CatalogChange.id).all()
+            fresh = [row for row in rows if row.id not in self._seen]
+            self._version = max(self._version, window[1] or 0)
+            # Remember the new window from the rows in hand rather than querying it again
+            self._seen = {row.id for row in rows if row.id > self._version - self.overlap}
+            self._window = (len(self._seen), max(self._seen, default=None))
+
+        for scope, scope_id in {(row.scope, row.scope_id) for row in fresh}:
+            for callback in self._listeners.get(scope, ()):
+                try:
+                    callback(scope_id)
+                except Exception as e:
+                    logger.error(f"Error invalidating {scope} {scope_id}: {e}")
+        return len(fresh)
+
+    def poll_if_due(self, interval):
+        """poll() unless this process polled within the last `interval` seconds."""
+        if time.monotonic() - self._polled_at >= interval:
+            self.poll()
+
+def prune(days):
+    """Delete changes older than `days`; every process has long since seen them. Requires an app context."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = CatalogChange.query.filter(CatalogChange.created_at < cutoff).delete()
+    db.session.commit()
+    return deleted
+
+feed = ChangeFeed()
+
+async def run_change_poller(app):
+    """Poll the change feed, and prune it now and then, until cancelled."""
+    pruned_at = time.monotonic()
+    while True:
+        await asyncio.sleep(app.config['CHANGE_POLL_SECONDS'])
+        try:
+            with app.app_context():
+                feed.poll()
+                if time.monotonic() - pruned_at > 3600:
+                    prune(app.config['CHANGE_LOG_RETENTION_DAYS'])
+                    pruned_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error polling catalog changes: {e}")
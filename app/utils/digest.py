@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, func, literal
+
+from ..models.database import db, User, Subscription, PendingNotification, Note
+from . import metrics, subscriptions
+
+logger = logging.getLogger(__name__)
+
+# Keep a digest well inside Telegram's 4096 character message limit
+MAX_NOTES_PER_DIGEST = 30
+
+def queue_note(note):
+    """Queue a new note once for every digest-mode user subscribed anywhere above it."""
+    covering = subscriptions.recipients(note.teacher_id).subquery()
+    pending = select(
+        covering.c.subscription_id,
+        literal(note.id),
+        literal(datetime.utcnow())
+    ).join(User, User.id == covering.c.user_id).where(
+        User.digest_mode.is_(True)
+    )
+    result = db.session.execute(
+        insert(PendingNotification).from_select(
+            ['subscription_id', 'note_id', 'created_at'], pending
+        )
+    )
+    db.session.commit()
+    metrics.increment('digest_events_queued', result.rowcount)
+    return result.rowcount
+
+def format_digest(notes, bot_username):
+    """Build one message listing new notes grouped by lesson."""
+    by_lesson = {}
+    for note in notes[:MAX_NOTES_PER_DIGEST]:
+        by_lesson.setdefault(note.teacher.lesson.name, []).append(note)
+
+    text = "📢 جزوه‌های جدید درس‌های شما:\n"
+    for lesson_name, lesson_notes in by_lesson.items():
+        text += f"\n📖 *{lesson_name}*\n"
+        for note in lesson_notes:
+            text += (
+                f"• [{note.name}](https://t.me/{bot_username}?start=note_{note.id})"
+                f" - استاد {note.teacher.name}\n"
+            )
+    if len(notes) > MAX_NOTES_PER_DIGEST:
+        text += f"\nو {len(notes) - MAX_NOTES_PER_DIGEST} جزوه دیگر..."
+    return text
+
+async def flush_due_digests(bot, window_minutes):
+    """Send one digest to every user whose oldest queued note has waited a full window.
+
+    Queued notes are removed once their digest is sent. They are kept for
+    the next round when sending fails for a reason that may pass, such as
+    a network error or flood control, and dropped only when the user can
+    never receive them: gone, blocked the bot, or a chat Telegram rejects.
+    """
+    # Deferred so importing this module from the admin tier does not load telegram
+    from telegram.error import BadRequest, Forbidden
+    from .rate_limit import BULK_ARGS
+
+    cutoff = datetime.utcnow() - timedelta(minutes=window_minutes)
+    due_user_ids = db.session.execute(
+        select(Subscription.user_id)
+        .join(PendingNotification, PendingNotification.subscription_id == Subscription.id)
+        .group_by(Subscription.user_id)
+        .having(func.min(PendingNotification.created_at) <= cutoff)
+    ).scalars().all()
+
+    for user_id in due_user_ids:
+        pending = db.session.execute(
+            select(PendingNotification.id, PendingNotification.note_id)
+            .join(Subscription, Subscription.id == PendingNotification.subscription_id)
+            .where(Subscription.user_id == user_id)
+        ).all()
+        note_ids = {note_id for _, note_id in pending}
+        notes = Note.query.filter(Note.id.in_(note_ids)).order_by(Note.upload_date).all()
+        user = User.query.get(user_id)
+
+        if notes and user and user.telegram_id:
+            try:
+                await bot.send_message(
+                    chat_id=user.telegram_id,
+                    text=format_digest(notes, bot.username),
+                    parse_mode='Markdown',
+                    disable_web_page_preview=True,
+                    rate_limit_args=BULK_ARGS
+                )
+                metrics.increment('digest_messages_sent')
+                # Without a digest every queued event would have been its own message
+                metrics.increment('digest_messages_saved', len(pending) - 1)
+            except (Forbidden, BadRequest) as e:
+                # Retrying cannot help; drop the digest like a sent one
+                logger.warning(f"Dropping digest for user {user.telegram_id}: {e}")
+                metrics.increment('digest_failures')
+            except Exception as e:
+                logger.error(f"Error sending digest to user {user.telegram_id}, will retry: {e}")
+                metrics.increment('digest_failures')
+                continue
+
+        PendingNotification.query.filter(
+            PendingNotification.id.in_([pending_id for pending_id, _ in pending])
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+async def run_digest_flusher(app, bot):
+    """Periodically flush due digests until cancelled."""
+    while True:
+        await asyncio.sleep(app.config['DIGEST_CHECK_INTERVAL'])
+        try:
+            with app.app_context():
+                await flush_due_digests(bot, app.config['DIGEST_WINDOW_MINUTES'])
+        except Exception as e:
+            logger.error(f"Error flushing digests: {e}")
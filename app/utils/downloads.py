@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import select, func, bindparam, tuple_
+
+from ..models.database import db, Note, Lesson, Teacher, User, NoteDownloadStat
+from . import changes, metrics, ranking
+
+logger = logging.getLogger(__name__)
+
+class DownloadCounters:
+    """In-memory download tallies written to the database in batched UPDATEs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._notes = defaultdict(int)
+        self._users = defaultdict(int)
+
+    def record(self, note_id, telegram_id):
+        """Count one download; nothing touches the database until flush()."""
+        with self._lock:
+            self._notes[(note_id, date.today())] += 1
+            self._users[telegram_id] += 1
+
+    def _drain(self):
+        with self._lock:
+            notes, self._notes = self._notes, defaultdict(int)
+            users, self._users = self._users, defaultdict(int)
+        return notes, users
+
+    def _restore(self, notes, users):
+        with self._lock:
+            for key, count in notes.items():
+                self._notes[key] += count
+            for key, count in users.items():
+                self._users[key] += count
+
+    def flush(self):
+        """Apply the buffered counts in one transaction; requires an app context."""
+        notes, users = self._drain()
+        if not notes and not users:
+            return 0
+
+        try:
+            note_totals = defaultdict(int)
+            for (note_id, _), count in notes.items():
+                note_totals[note_id] += count
+
+            note_table = Note.__table__
+            if note_totals:
+                db.session.execute(
+                    note_table.update()
+                    .where(note_table.c.id == bindparam('b_id'))
+                    .values(download_count=func.coalesce(note_table.c.download_count, 0) + bindparam('b_count')),
+                    [{'b_id': note_id, 'b_count': count} for note_id, count in note_totals.items()]
+                )
+
+            user_table = User.__table__
+            if users:
+                db.session.execute(
+                    user_table.update()
+                    .where(user_table.c.telegram_id == bindparam('b_telegram_id'))
+                    .values(notes_viewed=func.coalesce(user_table.c.notes_viewed, 0) + bindparam('b_count')),
+                    [{'b_telegram_id': telegram_id, 'b_count': count} for telegram_id, count in users.items()]
+                )
+
+            self._flush_daily(notes)
+            ranking.record_downloads(note_totals)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._restore(notes, users)
+            raise
+
+        flushed = sum(notes.values())
+        metrics.increment('downloads_flushed', flushed)
+        return flushed
+
+    def _flush_daily(self, notes):
+        stat_table = NoteDownloadStat.__table__
+        existing = set(db.session.execute(
+            select(stat_table.c.note_id, stat_table.c.day)
+            .where(tuple_(stat_table.c.note_id, stat_table.c.day).in_(list(notes)))
+        ).all())
+
+        updates = [
+            {'b_note_id': note_id, 'b_day': day, 'b_count': count}
+            for (note_id, day), count in notes.items() if (note_id, day) in existing
+        ]
+        inserts = [
+            {'note_id': note_id, 'day': day, 'count': count}
+            for (note_id, day), count in notes.items() if (note_id, day) not in existing
+        ]
+        if updates:
+            db.session.execute(
+                stat_table.update()
+                .where(stat_table.c.note_id == bindparam('b_note_id'))
+                .where(stat_table.c.day == bindparam('b_day'))
+                .values(count=stat_table.c.count + bindparam('b_count')),
+                updates
+            )
+        if inserts:
+            db.session.execute(stat_table.insert(), inserts)
+
+counters = DownloadCounters()
+
+_top_cache = {}
+_top_cache_lock = threading.Lock()
+
+def top_downloads(lesson_id=None, limit=10, days=7, ttl=300):
+    """Return the most downloaded notes of the last `days` days, cached for `ttl` seconds.
+
+    Rows are plain dicts so they can be shared between app contexts.
+    """
+    key = (lesson_id, limit, days)
+    now = time.monotonic()
+    with _top_cache_lock:
+        cached = _top_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    since = date.today() - timedelta(days=days - 1)
+    downloads = func.sum(NoteDownloadStat.count).label('downloads')
+    query = (
+        db.session.query(Note.id, Note.name, Lesson.name, downloads)
+        .join(NoteDownloadStat, NoteDownloadStat.note_id == Note.id)
+        .join(Teacher, Teacher.id == Note.teacher_id)
+        .join(Lesson, Lesson.id == Teacher.lesson_id)
+        .filter(NoteDownloadStat.day >= since)
+    )
+    if lesson_id is not None:
+        query = query.filter(Teacher.lesson_id == lesson_id)
+    rows = query.group_by(Note.id, Note.name, Lesson.name).order_by(downloads.desc()).limit(limit).all()
+    result = [
+        {'id': note_id, 'name': name, 'lesson': lesson_name, 'downloads': count}
+        for note_id, name, lesson_name, count in rows
+    ]
+
+    with _top_cache_lock:
+        _top_cache[key] = (now + ttl, result)
+    return result
+
+def invalidate_top(lesson_id=None):
+    """Forget cached top lists that may include notes of `lesson_id`, or all of them."""
+    with _top_cache_lock:
+        for key in list(_top_cache):
+            if lesson_id is None or key[0] in (None, lesson_id):
+                del _top_cache[key]
+
+# Notes added, renamed, moved or deleted in another process change the lists too
+changes.feed.on(changes.LESSON, invalidate_top)
+
+async def run_download_flusher(app):
+    """Periodically flush buffered download counters until cancelled."""
+    while True:
+        await asyncio.sleep(app.config['DOWNLOAD_FLUSH_INTERVAL'])
+        try:
+            with app.app_context():
+                counters.flush()
+        except Exception as e:
+            logger.error(f"Error flushing download counters: {e}")
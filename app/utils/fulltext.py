@@ -0,0 +1,210 @@
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sqlalchemy import bindparam, text
+
+from ..models.database import db, Note, NotePage
+from . import metrics
+from .taxonomy import normalize
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_WORD = re.compile(r'\w+')
+
+def _get_executor(workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned workers share no threads or database connections with the web process
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+def normalize_text(raw):
+    """Normalize extracted text so it matches normalized queries.
+
+    NFKC turns Arabic presentation forms, which many PDF producers emit
+    for Persian, back into ordinary letters before the taxonomy folding.
+    """
+    return normalize(unicodedata.normalize('NFKC', raw or ''))
+
+def extract_pages(path):
+    """Return the normalized text layer of every page of the PDF at `path`; runs in a worker process."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    pages = []
+    for page in reader.pages:
+        try:
+            pages.append(normalize_text(page.extract_text()))
+        except Exception as e:
+            # One broken content stream should not lose the rest of the document
+            logger.debug(f"Skipping text of a page in {path}: {e}")
+            pages.append('')
+    return pages
+
+def discard(note):
+    """Forget a note's indexed text, e.g. before its file is replaced or deleted."""
+    NotePage.query.filter_by(note_id=note.id).delete()
+    note.text_pages = None
+
+def record_result(note_id, source, pages):
+    """Replace the note's indexed pages with `pages`; requires an app context."""
+    note = db.session.get(Note, note_id)
+    if not note or note.file_path != source:
+        # The note was deleted or given a new file while we worked
+        return False
+
+    NotePage.query.filter_by(note_id=note_id).delete()
+    db.session.add_all([
+        NotePage(note_id=note_id, page=number, text=page_text)
+        for number, page_text in enumerate(pages, 1) if page_text
+    ])
+    note.text_pages = len(pages)
+    db.session.commit()
+    metrics.increment('pdf_pages_indexed', len(pages))
+    return True
+
+def _available():
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        logger.warning("PDF_TEXT_INDEX is enabled but pypdf is not installed")
+        return False
+    return True
+
+def submit(app, note):
+    """Extract a note's text in the process pool if enabled; results are recorded when it finishes."""
+    config = app.config
+    if not config['PDF_TEXT_INDEX'] or not _available():
+        return None
+
+    note_id, source = note.id, note.file_path
+    future = _get_executor(config['PDF_TEXT_WORKERS'] or os.cpu_count()).submit(extract_pages, source)
+
+    def done(future):
+        try:
+            pages = future.result()
+            with app.app_context():
+                record_result(note_id, source, pages)
+        except Exception as e:
+            logger.error(f"Error extracting text of note {note_id}: {e}")
+
+    future.add_done_callback(done)
+    return future
+
+def backfill(workers=None, batch_size=100, progress=None):
+    """Index every note whose text has not been extracted yet; requires an app context.
+
+    Notes are handed to a pool of `workers` processes (all cores by
+    default) a batch at a time and each result is committed as soon as it
+    arrives, so an interrupted run resumes where it stopped. Returns the
+    number of notes indexed.
+    """
+    if not _available():
+        return 0
+
+    done = 0
+    failed = set()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        while True:
+            query = Note.query.filter(Note.text_pages.is_(None))
+            if failed:
+                query = query.filter(Note.id.notin_(failed))
+            batch = query.order_by(Note.id).limit(batch_size).with_entities(Note.id, Note.file_path).all()
+            if not batch:
+                return done
+
+            futures = {pool.submit(extract_pages, path): (note_id, path) for note_id, path in batch}
+            for future in as_completed(futures):
+                note_id, path = futures[future]
+                try:
+                    if record_result(note_id, path, future.result()):
+                        done += 1
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error extracting text of note {note_id}: {e}")
+                    failed.add(note_id)
+                if progress:
+                    progress(note_id, done)
+
+def _match_expression(query):
+    """Turn free text into an FTS5 query: every word must appear, the last one as a prefix."""
+    words = _WORD.findall(normalize_text(query))
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def search(query, limit=10, pages_per_note=3):
+    """Find notes whose text contains every word of `query`; requires an app context.
+
+    Returns up to `limit` (note, [(page, snippet), ...]) pairs, best match
+    first. Notes are ranked by their best page, so a long note matching on
+    many pages cannot push the others out, and snippets are then made only
+    for the chosen notes. SQLite uses the FTS5 index; other databases fall
+    back to a LIKE scan of the stored pages.
+    """
+    expression = _match_expression(query)
+    if expression is None:
+        return []
+
+    if db.engine.dialect.name == 'sqlite':
+        params = {'expression': expression, 'limit': limit, 'pages': pages_per_note}
+        # FTS5 rank and auxiliary functions such as snippet() only work on the
+        # rows of the MATCH itself, so they are computed in inner queries
+        matches = (
+            "SELECT note_page.note_id, note_page.page, rank AS score{snippet} "
+            "FROM note_page_fts JOIN note_page ON note_page.id = note_page_fts.rowid "
+            "WHERE note_page_fts MATCH :expression{where}"
+        )
+        note_ids = db.session.execute(text(
+            "SELECT note_id FROM (" + matches.format(snippet='', where='') + ") "
+            "GROUP BY note_id ORDER BY min(score) LIMIT :limit"
+        ), params).scalars().all()
+        if not note_ids:
+            return []
+        rows = db.session.execute(text(
+            "SELECT note_id, page, snippet_text FROM ("
+            "SELECT note_id, page, snippet_text, "
+            "row_number() OVER (PARTITION BY note_id ORDER BY score) AS position FROM ("
+            + matches.format(
+                snippet=", snippet(note_page_fts, 0, '', '', '…', 12) AS snippet_text",
+                where=" AND note_page.note_id IN :note_ids"
+            ) +
+            ")) WHERE position <= :pages"
+        ).bindparams(bindparam('note_ids', expanding=True)), dict(params, note_ids=note_ids)).all()
+    else:
+        words = _WORD.findall(normalize_text(query))
+        page_query = db.session.query(NotePage.note_id, NotePage.page, NotePage.text)
+        for word in words:
+            page_query = page_query.filter(NotePage.text.contains(word, autoescape=True))
+        note_ids = [
+            note_id for note_id, in
+            page_query.with_entities(NotePage.note_id).distinct().order_by(NotePage.note_id).limit(limit)
+        ]
+        rows = [
+            (note_id, page, _snippet(page_text, words[0]))
+            for note_id, page, page_text in page_query.filter(NotePage.note_id.in_(note_ids)).order_by(NotePage.page)
+        ] if note_ids else []
+
+    hits = {note_id: [] for note_id in note_ids}
+    for note_id, page, snippet in rows:
+        if len(hits[note_id]) < pages_per_note:
+            hits[note_id].append((page, snippet))
+    notes = {note.id: note for note in Note.query.filter(Note.id.in_(note_ids))}
+    return [(notes[note_id], sorted(hits[note_id])) for note_id in note_ids if note_id in notes]
+
+def _snippet(page_text, word, width=60):
+    position = max(page_text.find(word), 0)
+    start = max(position - width, 0)
+    return ('…' if start else '') + page_text[start:position + width] + '…'
@@ -0,0 +1,45 @@
+import os
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+
+def increment(name, value=1):
+    """Add `value` to a process-wide counter."""
+    with _lock:
+        _counters[name] += value
+
+def set_gauge(name, value):
+    """Record the latest value of a gauge."""
+    with _lock:
+        _gauges[name] = value
+
+def get(name):
+    """Return the current value of a counter or gauge."""
+    with _lock:
+        if name in _gauges:
+            return _gauges[name]
+        return _counters.get(name, 0)
+
+def snapshot():
+    """Return all counters and gauges as a plain dict."""
+    with _lock:
+        data = dict(_counters)
+        data.update(_gauges)
+        return data
+
+def resident_memory():
+    """Return this process's resident set size in bytes, or 0 where it cannot be read."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # Without procfs (macOS) only the peak is available, already in bytes there
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,148 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from ..models.database import db, Note
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+OPTIMIZED_FOLDER = '.optimized'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor(workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned workers share no threads or database connections with the web process
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+def _recompress_image(raw, max_dimension, quality):
+    """Replace one image XObject with a downscaled JPEG if that makes it smaller."""
+    from PIL import Image
+    from pikepdf import Name, PdfImage
+
+    if raw.get('/ImageMask') or raw.get('/SMask') is not None or raw.get('/BitsPerComponent') != 8:
+        return False
+    image = PdfImage(raw).as_pil_image()
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if max(image.size) > max_dimension:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    if buffer.tell() >= len(raw.read_raw_bytes()):
+        return False
+
+    raw.write(buffer.getvalue(), filter=Name.DCTDecode)
+    raw.Width, raw.Height = image.size
+    raw.ColorSpace = Name.DeviceRGB if image.mode == 'RGB' else Name.DeviceGray
+    raw.BitsPerComponent = 8
+    for key in ('/DecodeParms', '/Decode'):
+        if key in raw:
+            del raw[key]
+    return True
+
+def optimize_file(source, target, max_dimension=2000, quality=75):
+    """Write a smaller copy of the PDF at `source` to `target`; runs in a worker process.
+
+    Embedded images are downscaled and recompressed as JPEG when that
+    shrinks them, unused resources are dropped and the result is saved
+    linearized with compressed object streams. Returns the target's size.
+    """
+    import pikepdf
+
+    with pikepdf.open(source) as pdf:
+        seen = set()
+        for page in pdf.pages:
+            # get_images() replaced the images mapping in newer pikepdf releases
+            images = page.get_images() if hasattr(page, 'get_images') else page.images
+            for raw in images.values():
+                if raw.objgen in seen:
+                    continue
+                seen.add(raw.objgen)
+                try:
+                    _recompress_image(raw, max_dimension, quality)
+                except Exception as e:
+                    # Unusual colour spaces or filters are left untouched
+                    logger.debug(f"Skipping image {raw.objgen}: {e}")
+        pdf.remove_unreferenced_resources()
+        pdf.save(
+            target,
+            linearize=True,
+            compress_streams=True,
+            recompress_flate=True,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate
+        )
+    return os.path.getsize(target)
+
+def optimized_path_for(note):
+    folder = os.path.join(os.path.dirname(note.file_path), OPTIMIZED_FOLDER)
+    return os.path.join(folder, f'{note.id}-{os.path.basename(note.file_path)}')
+
+def discard(note):
+    """Forget a note's optimized copy, e.g. before its file is replaced or deleted."""
+    if note.optimized_path and os.path.exists(note.optimized_path):
+        os.remove(note.optimized_path)
+    note.optimized_path = None
+    note.original_size = None
+    note.optimized_size = None
+
+def record_result(note_id, source, target, optimized_size, min_saving):
+    """Store before/after sizes and keep the copy only if it is meaningfully smaller; requires an app context."""
+    note = db.session.get(Note, note_id)
+    if not note or note.file_path != source:
+        # The note was deleted or given a new file while we worked
+        if os.path.exists(target):
+            os.remove(target)
+        return False
+
+    note.original_size = os.path.getsize(source)
+    note.optimized_size = optimized_size
+    worthwhile = optimized_size <= note.original_size * (1 - min_saving)
+    if worthwhile:
+        note.optimized_path = target
+        metrics.increment('pdf_bytes_saved', note.original_size - optimized_size)
+    else:
+        note.optimized_path = None
+        os.remove(target)
+    db.session.commit()
+    metrics.increment('pdfs_optimized')
+    return worthwhile
+
+def submit(app, note):
+    """Optimize a note's PDF in the process pool if enabled; results are recorded when it finishes."""
+    config = app.config
+    if not config['PDF_OPTIMIZE']:
+        return None
+    try:
+        import pikepdf  # noqa: F401
+    except ImportError:
+        logger.warning("PDF_OPTIMIZE is enabled but pikepdf is not installed")
+        return None
+
+    note_id, source, target = note.id, note.file_path, optimized_path_for(note)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    future = _get_executor(config['PDF_OPTIMIZE_WORKERS']).submit(
+        optimize_file, source, target, config['PDF_IMAGE_MAX_DIMENSION'], config['PDF_IMAGE_QUALITY']
+    )
+
+    def done(future):
+        try:
+            optimized_size = future.result()
+            with app.app_context():
+                record_result(note_id, source, target, optimized_size, config['PDF_OPTIMIZE_MIN_SAVING'])
+        except Exception as e:
+            logger.error(f"Error optimizing note {note_id}: {e}")
+            if os.path.exists(target):
+                os.remove(target)
+
+    future.add_done_callback(done)
+    return future
@@ -0,0 +1,232 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# The profile record of the update being handled in the current task, if any
+_current = contextvars.ContextVar('update_profile', default=None)
+
+class _Record:
+    __slots__ = (
+        'update_id', 'started', 'sampled', 'coroutine', 'handlers',
+        'samples', 'db_seconds', 'db_queries', 'api_seconds', 'api_calls', 'api_wait_seconds'
+    )
+
+    def __init__(self, update_id, sampled):
+        self.update_id = update_id
+        self.started = time.perf_counter()
+        self.sampled = sampled
+        self.coroutine = None
+        self.handlers = []
+        self.samples = Counter()
+        self.db_seconds = 0.0
+        self.db_queries = 0
+        self.api_seconds = 0.0
+        self.api_calls = 0
+        self.api_wait_seconds = 0.0
+
+def add_api_time(seconds, waited=0.0):
+    """Charge a Bot API call to the update being profiled; a no-op otherwise."""
+    record = _current.get()
+    if record is not None:
+        record.api_seconds += seconds
+        record.api_wait_seconds += waited
+        record.api_calls += 1
+
+def track_handler(callback):
+    """Wrap a handler callback so profiles name the handler that ran."""
+    async def tracked(*args, **kwargs):
+        record = _current.get()
+        if record is not None:
+            record.handlers.append(callback.__name__)
+        return await callback(*args, **kwargs)
+    tracked.__name__ = callback.__name__
+    return tracked
+
+_TRACKED_CODE = track_handler(track_handler).__code__
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record = _current.get()
+    started = conn.info.get('profile_started')
+    if record is not None and started:
+        record.db_seconds += time.perf_counter() - started.pop()
+        record.db_queries += 1
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _await_chain(coroutine):
+    """Frames of a suspended coroutine from the outermost await down to where it waits."""
+    frames = []
+    while coroutine is not None:
+        frame = getattr(coroutine, 'cr_frame', None) or getattr(coroutine, 'gi_frame', None)
+        if frame is not None:
+            frames.append(frame)
+        coroutine = getattr(coroutine, 'cr_await', None) or getattr(coroutine, 'gi_yieldfrom', None)
+    return frames
+
+class UpdateProfiler:
+    """Times every update and keeps stack samples only for slow or randomly chosen ones.
+
+    A sampler thread polls the updates in flight and starts sampling one
+    once it has run for `sample_after_ms` (or from the start when it was
+    picked at random), so fast updates cost two clock reads, a dict entry
+    and a context variable. A sample
+    is the loop thread's stack while the update runs, or the await chain
+    it is suspended in. Updates slower than `slow_ms` or picked at random
+    are written to `directory` as collapsed stacks (flamegraph.pl,
+    speedscope) with a JSON sidecar holding the handler, DB and API times.
+    Only the newest `max_files` profiles are kept.
+    """
+
+    def __init__(self, directory, slow_ms=1000, sample_rate=0.0, interval_ms=5,
+                 sample_after_ms=100, max_files=200):
+        self.directory = directory
+        self.slow = slow_ms / 1000
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.sample_after = sample_after_ms / 1000
+        self.max_files = max_files
+        self._active = {}
+        self._loop_thread = None
+        self._watchdog = None
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build the profiler if PROFILE_UPDATES is on, else return None."""
+        if not config['PROFILE_UPDATES']:
+            return None
+        return cls(
+            directory=config['PROFILE_DIR'],
+            slow_ms=config['PROFILE_SLOW_MS'],
+            sample_rate=config['PROFILE_SAMPLE_RATE'],
+            interval_ms=config['PROFILE_INTERVAL_MS'],
+            sample_after_ms=config['PROFILE_SAMPLE_AFTER_MS'],
+            max_files=config['PROFILE_MAX_FILES']
+        )
+
+    def _start_watchdog(self):
+        self._loop_thread = threading.get_ident()
+        self._watchdog = threading.Thread(target=self._sample_forever, name='update-profiler', daemon=True)
+        self._watchdog.start()
+
+    async def profile(self, update, coroutine):
+        """Run the update's processing coroutine under the profiler."""
+        if self._watchdog is None:
+            self._start_watchdog()
+
+        record = _Record(getattr(update, 'update_id', None), random.random() < self.sample_rate)
+        token = _current.set(record)
+        record.coroutine = self._run(coroutine)
+        self._active[id(record)] = record
+        try:
+            return await record.coroutine
+        finally:
+            del self._active[id(record)]
+            _current.reset(token)
+            elapsed = time.perf_counter() - record.started
+            metrics.increment('updates_timed')
+            if elapsed >= self.slow:
+                metrics.increment('slow_updates')
+            if elapsed >= self.slow or record.sampled:
+                await asyncio.get_running_loop().run_in_executor(None, self._dump, record, elapsed)
+
+    async def _run(self, coroutine):
+        return await coroutine
+
+    def _sample_forever(self):
+        # Polls from its own thread so updates that block the loop are caught too
+        while True:
+            now = time.perf_counter()
+            due = [
+                record for record in list(self._active.values())
+                if record.sampled or now - record.started >= self.sample_after
+            ]
+            if due:
+                self._sample(due)
+                time.sleep(self.interval)
+            else:
+                time.sleep(self.sample_after / 2)
+
+    def _sample(self, records):
+        running = sys._current_frames().get(self._loop_thread)
+        running_stack = []
+        while running is not None:
+            running_stack.append(running)
+            running = running.f_back
+
+        for record in records:
+            coroutine = record.coroutine
+            root = getattr(coroutine, 'cr_frame', None)
+            if root is None:
+                continue
+            if root in running_stack:
+                # On CPU: the loop thread is executing this update right now
+                frames = list(reversed(running_stack[:running_stack.index(root) + 1]))
+                leaf = None
+            else:
+                frames = _await_chain(coroutine)
+                leaf = '[waiting]'
+            names = [_frame_name(frame) for frame in frames[1:] if frame.f_code is not _TRACKED_CODE]
+            if leaf:
+                names.append(leaf)
+            record.samples[';'.join(names) or '[idle]'] += 1
+
+    def _dump(self, record, elapsed):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handler = record.handlers[0] if record.handlers else 'unhandled'
+            base = os.path.join(
+                self.directory,
+                f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')}-{record.update_id}-{handler}"
+            )
+            with open(base + '.folded', 'w', encoding='utf-8') as f:
+                for stack, count in record.samples.most_common():
+                    f.write(f"{handler};{stack} {count}\n")
+            with open(base + '.json', 'w', encoding='utf-8') as f:
+                json.dump({
+                    'update_id': record.update_id,
+                    'handlers': record.handlers,
+                    'total_ms': round(elapsed * 1000, 1),
+                    'db_ms': round(record.db_seconds * 1000, 1),
+                    'db_queries': record.db_queries,
+                    'api_ms': round(record.api_seconds * 1000, 1),
+                    'api_wait_ms': round(record.api_wait_seconds * 1000, 1),
+                    'api_calls': record.api_calls,
+                    'sampled_at_random': record.sampled,
+                    'sample_interval_ms': self.interval * 1000,
+                    'samples': sum(record.samples.values())
+                }, f, ensure_ascii=False, indent=2)
+            self._rotate()
+        except Exception as e:
+            logger.error(f"Error writing update profile: {e}")
+
+    def _rotate(self):
+        profiles = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        # A slice of [:-0] would be empty, so count the excess explicitly
+        for name in profiles[:max(0, len(profiles) - self.max_files)]:
+            for suffix in ('.json', '.folded'):
+                path = os.path.join(self.directory, name[:-len('.json')] + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
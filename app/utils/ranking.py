@@ -0,0 +1,100 @@
+import math
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select, bindparam, func, literal_column
+
+from ..models.database import db, Note, NoteDownloadStat
+
+# Trending keys are measured from this fixed instant so stored values never need rescaling
+EPOCH = datetime(2024, 1, 1)
+
+def bayesian_score(rating_sum, rating_count):
+    """Average rating pulled towards the prior mean until a note has enough votes."""
+    prior_mean = current_app.config['RANKING_PRIOR_MEAN']
+    prior_weight = current_app.config['RANKING_PRIOR_WEIGHT']
+    return (prior_weight * prior_mean + (rating_sum or 0)) / (prior_weight + (rating_count or 0))
+
+def _decay_rate():
+    return math.log(2) / current_app.config['RANKING_HALF_LIFE_HOURS']
+
+def add_activity(trending_score, weight, when=None):
+    """Fold `weight` events at `when` into a trending score.
+
+    The score is log(1 + sum(w * exp(rate * hours_since_epoch))). Decaying
+    every note by the same factor never changes their order, so the stored
+    value sorts exactly like the current decayed activity without ever
+    being rewritten, and adding an event is a single log-add-exp.
+    """
+    when = when or datetime.utcnow()
+    hours = (when - EPOCH).total_seconds() / 3600
+    event = math.log(weight) + _decay_rate() * hours
+    current = trending_score or 0.0
+    high, low = max(current, event), min(current, event)
+    return high + math.log1p(math.exp(low - high))
+
+def listing_rank():
+    """Sort key for a teacher's note list: the Bayesian score, with unscored notes last.
+
+    The literal 0 is spelled out in the SQL so it matches the expression in
+    ix_note_teacher_rank and SQLite can read pages from that index. Without
+    coalescing, keyset cursors never move past a NULL score.
+    """
+    return func.coalesce(Note.bayesian_score, literal_column('0'))
+
+def init_note(note):
+    """Give a freshly uploaded note its starting scores."""
+    note.bayesian_score = bayesian_score(note.rating_sum, note.rating_count)
+    note.trending_score = 0.0
+
+def record_rating(note):
+    """Update a note's scores after its rating_sum/rating_count were incremented."""
+    note.bayesian_score = bayesian_score(note.rating_sum, note.rating_count)
+    note.trending_score = add_activity(note.trending_score, 1)
+
+def record_downloads(note_totals, when=None):
+    """Fold batched download counts {note_id: count} into trending scores."""
+    if not note_totals:
+        return
+    note_table = Note.__table__
+    current = dict(db.session.execute(
+        select(note_table.c.id, note_table.c.trending_score)
+        .where(note_table.c.id.in_(list(note_totals)))
+    ).all())
+    updates = [
+        {'b_id': note_id, 'b_score': add_activity(score, note_totals[note_id], when)}
+        for note_id, score in current.items()
+    ]
+    if updates:
+        db.session.execute(
+            note_table.update()
+            .where(note_table.c.id == bindparam('b_id'))
+            .values(trending_score=bindparam('b_score')),
+            updates
+        )
+
+def recompute_all():
+    """Rebuild every note's scores; used once when upgrading an existing database."""
+    prior_mean = current_app.config['RANKING_PRIOR_MEAN']
+    prior_weight = current_app.config['RANKING_PRIOR_WEIGHT']
+    Note.query.update({
+        Note.bayesian_score: (prior_weight * prior_mean + func.coalesce(Note.rating_sum, 0))
+        / (prior_weight + func.coalesce(Note.rating_count, 0)),
+        Note.trending_score: 0.0
+    }, synchronize_session=False)
+
+    scores = {}
+    for stat in NoteDownloadStat.query.order_by(NoteDownloadStat.day):
+        when = datetime.combine(stat.day, datetime.min.time())
+        scores[stat.note_id] = add_activity(scores.get(stat.note_id), stat.count, when)
+    for note_id, score in scores.items():
+        Note.query.filter_by(id=note_id).update({Note.trending_score: score}, synchronize_session=False)
+    db.session.commit()
+
+def top_notes(order='rated', limit=10):
+    """Return the best notes by Bayesian rating or trending activity, read from an index."""
+    if order == 'rated':
+        score, condition = Note.bayesian_score, Note.bayesian_score.isnot(None)
+    else:
+        score, condition = Note.trending_score, Note.trending_score > 0
+    return Note.query.filter(condition).order_by(score.desc(), Note.id.desc()).limit(limit).all()
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import Config
+from . import metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)
+
+# Pass as rate_limit_args= on notification, digest and broadcast sends
+BULK_ARGS = {'priority': BULK}
+
+# Calls that do not count towards Telegram's message flood limits
+UNLIMITED_ENDPOINTS = frozenset({'getMe', 'getUpdates', 'answerCallbackQuery', 'getFile', 'deleteWebhook'})
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+    def refill(self, now, rate, burst):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+class OutboundScheduler(BaseRateLimiter):
+    """Process-wide budget for every Bot API call, with interactive traffic first.
+
+    A global token bucket models Telegram's overall limit and per-chat
+    buckets its per-chat limits. Bulk calls (notifications, digests,
+    broadcasts) only spend global tokens above `interactive_reserve` and
+    never while an interactive call is waiting, so menu replies preempt
+    them. A RetryAfter from any call pauses all traffic until it expires.
+
+    State is guarded by a thread lock and waits are plain asyncio sleeps,
+    so one instance can serve the bot's loop and the admin client's loop
+    in the same process.
+    """
+
+    def __init__(self, rate=30, burst=30, chat_rate=1, chat_burst=3,
+                 group_rate=20 / 60, interactive_reserve=5, max_retries=3, max_chats=10000):
+        self.rate = rate
+        self.burst = burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.interactive_reserve = interactive_reserve
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._lock = threading.Lock()
+        self._global = _Bucket(burst, time.monotonic())
+        self._chats = OrderedDict()
+        self._paused_until = 0.0
+        self._interactive_waiting = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = _Bucket(self.chat_burst, now)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _try_acquire(self, priority, chat_id, now):
+        """Take tokens for one call; return 0 on success, else seconds to wait before retrying."""
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        self._global.refill(now, self.rate, self.burst)
+        needed = 1
+        if priority == BULK:
+            if self._interactive_waiting:
+                return 1 / self.rate
+            needed += self.interactive_reserve
+        global_wait = max(0.0, (needed - self._global.tokens) / self.rate)
+
+        chat_wait = 0.0
+        chat = None
+        if chat_id is not None:
+            # Negative ids are groups and channels, which Telegram limits per minute
+            chat_rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            chat = self._chat_bucket(chat_id, now)
+            chat.refill(now, chat_rate, self.chat_burst)
+            chat_wait = max(0.0, (1 - chat.tokens) / chat_rate)
+
+        wait = max(global_wait, chat_wait)
+        if wait:
+            return wait
+        self._global.tokens -= 1
+        if chat is not None:
+            chat.tokens -= 1
+        return 0
+
+    async def _acquire(self, priority, chat_id):
+        started = time.monotonic()
+        waiting = False
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_acquire(priority, chat_id, time.monotonic())
+                    if wait and priority == INTERACTIVE and not waiting:
+                        self._interactive_waiting += 1
+                        waiting = True
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            if waiting:
+                with self._lock:
+                    self._interactive_waiting -= 1
+        waited = time.monotonic() - started
+        metrics.increment(f'outbound_calls_{priority}')
+        metrics.increment(f'outbound_wait_ms_{priority}', int(waited * 1000))
+        return waited
+
+    def _pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        metrics.increment('outbound_retry_after')
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in UNLIMITED_ENDPOINTS:
+            started = time.monotonic()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                profiling.add_api_time(time.monotonic() - started)
+
+        priority = (rate_limit_args or {}).get('priority', INTERACTIVE)
+        chat_id = data.get('chat_id')
+        for attempt in range(self.max_retries + 1):
+            waited = await self._acquire(priority, chat_id)
+            started = time.monotonic()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Telegram asked to retry {endpoint} after {e.retry_after}s; pausing all sends")
+                self._pause(e.retry_after)
+            finally:
+                profiling.add_api_time(time.monotonic() - started, waited)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Return the process-wide scheduler shared by the bot and the admin client."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = OutboundScheduler(
+                rate=Config.TELEGRAM_GLOBAL_RATE,
+                burst=Config.TELEGRAM_GLOBAL_RATE,
+                chat_rate=Config.TELEGRAM_CHAT_RATE,
+                group_rate=Config.TELEGRAM_GROUP_RATE_PER_MINUTE / 60,
+                interactive_reserve=Config.TELEGRAM_INTERACTIVE_RESERVE
+            )
+        return _scheduler
@@ -0,0 +1,118 @@
+from sqlalchemy import select, union_all, func
+
+from ..models.database import db, User, Subscription, PendingNotification, Note, Major, Semester, Lesson, Teacher
+
+# Subscription scopes from the broadest down, with the model each one names
+LEVELS = ('major', 'semester', 'lesson', 'teacher')
+MODELS = {'major': Major, 'semester': Semester, 'lesson': Lesson, 'teacher': Teacher}
+
+def _column(level):
+    return getattr(Subscription, f'{level}_id')
+
+def find(user_id, level, scope_id):
+    """The user's subscription at exactly this scope, or None."""
+    return Subscription.query.filter(
+        Subscription.user_id == user_id,
+        _column(level) == scope_id
+    ).first()
+
+def is_subscribed(telegram_id, level, scope_id):
+    """Whether the user with `telegram_id` is subscribed at exactly this scope."""
+    return db.session.query(
+        select(Subscription.id)
+        .join(User, User.id == Subscription.user_id)
+        .where(User.telegram_id == telegram_id, _column(level) == scope_id)
+        .exists()
+    ).scalar()
+
+def subscribe(user, level, scope_id):
+    """Subscribe `user` at a scope; returns False if they already were."""
+    if find(user.id, level, scope_id):
+        return False
+    db.session.add(Subscription(user_id=user.id, **{f'{level}_id': scope_id}))
+    db.session.commit()
+    return True
+
+def unsubscribe(user, level, scope_id):
+    """Drop the user's subscription at a scope; returns False if there was none.
+
+    A queued digest entry hangs off one of the subscriptions covering its
+    note (see `_covering`). Entries of this one move to another of the
+    user's subscriptions that still covers the note, and are dropped only
+    when none does.
+    """
+    subscription = find(user.id, level, scope_id)
+    if not subscription:
+        return False
+    pending = PendingNotification.query.filter_by(subscription_id=subscription.id).all()
+    db.session.delete(subscription)
+    db.session.flush()
+    for entry in pending:
+        other = _covering_subscription(user.id, entry.note_id)
+        if other:
+            entry.subscription_id = other
+        else:
+            db.session.delete(entry)
+    db.session.commit()
+    return True
+
+def _covering(chain, levels):
+    """SELECT of (user_id, subscription_id), one row per user subscribed anywhere on `chain`.
+
+    `chain` is a one-row CTE holding the id of each of `levels`. Every
+    level is matched by its own branch of a UNION ALL, each an index
+    lookup on that scope column, and grouping by user folds overlapping
+    subscriptions into a single row, so the result is as long as the
+    audience no matter how many levels a user subscribed at.
+    """
+    branches = [
+        select(Subscription.user_id, Subscription.id)
+        .join(chain, _column(level) == chain.c[f'{level}_id'])
+        for level in levels
+    ]
+    matched = union_all(*branches).subquery()
+    return select(
+        matched.c.user_id,
+        func.min(matched.c.id).label('subscription_id')
+    ).group_by(matched.c.user_id)
+
+def recipients(teacher_id):
+    """Subscribers who should hear about a new note of `teacher_id`; see `_covering`."""
+    chain = (
+        select(
+            Teacher.id.label('teacher_id'),
+            Teacher.lesson_id.label('lesson_id'),
+            Lesson.semester_id.label('semester_id'),
+            Semester.major_id.label('major_id')
+        )
+        .outerjoin(Lesson, Lesson.id == Teacher.lesson_id)
+        .outerjoin(Semester, Semester.id == Lesson.semester_id)
+        .where(Teacher.id == teacher_id)
+        # Nested, so an INSERT ... SELECT over the result still starts with INSERT and reports its rowcount
+        .cte('chain', nesting=True)
+    )
+    return _covering(chain, LEVELS)
+
+def _covering_subscription(user_id, note_id):
+    """Id of one of the user's subscriptions that covers the note, or None."""
+    note = db.session.get(Note, note_id)
+    if note is None:
+        return None
+    covering = recipients(note.teacher_id).subquery()
+    return db.session.execute(
+        select(covering.c.subscription_id).where(covering.c.user_id == user_id)
+    ).scalar()
+
+def lesson_recipients(lesson_id):
+    """Subscribers of a lesson, its semester or its major; see `_covering`."""
+    chain = (
+        select(
+            Lesson.id.label('lesson_id'),
+            Lesson.semester_id.label('semester_id'),
+            Semester.major_id.label('major_id')
+        )
+        .outerjoin(Semester, Semester.id == Lesson.semester_id)
+        .where(Lesson.id == lesson_id)
+        .cte('chain', nesting=True)
+    )
+    return _covering(chain, ('major', 'semester', 'lesson'))
@@ -0,0 +1,160 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from sqlalchemy import literal
+
+from ..models.database import db, Major, Semester, Lesson, Teacher
+from . import changes
+
+# Field name -> (model, parent foreign key column name), from the top of the tree down
+LEVELS = {
+    'major': (Major, None),
+    'semester': (Semester, 'major_id'),
+    'lesson': (Lesson, 'semester_id'),
+    'teacher': (Teacher, 'lesson_id')
+}
+ORDER = ('major', 'semester', 'lesson', 'teacher')
+
+_LETTERS = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ؤ': 'و',
+    '\u200c': ' ', '\u200e': None, '\u200f': None, '\u0640': None,
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)}
+})
+_MARKS = re.compile('[\u064b-\u065f\u0670]')
+_SPACES = re.compile(r'\s+')
+
+def normalize(name):
+    """Fold Arabic/Persian letter variants, digits, diacritics and spacing into one key."""
+    name = _MARKS.sub('', (name or '').translate(_LETTERS))
+    return _SPACES.sub(' ', name).strip().casefold()
+
+class TaxonomyIndex:
+    """Sorted in-memory prefix index over major/semester/lesson/teacher names.
+
+    Every name is keyed by its normalized form and by the normalized form
+    of each of its words onwards, grouped by (field, parent_id), so a
+    lookup is a bisect into one sorted list. The index is rebuilt lazily
+    after invalidate() or once it is older than `max_age` seconds.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._state = None
+        self._built_at = 0.0
+
+    def invalidate(self):
+        self._state = None
+
+    def _build(self):
+        groups = defaultdict(list)
+        exact = {}
+        for field in ORDER:
+            model, parent = LEVELS[field]
+            parent_column = getattr(model, parent) if parent else literal(0)
+            for item_id, name, parent_id in db.session.query(model.id, model.name, parent_column):
+                key = normalize(name)
+                scope = (field, parent_id or 0)
+                exact.setdefault((*scope, key), (item_id, name))
+                words = key.split(' ')
+                for i in range(len(words)):
+                    groups[scope].append((' '.join(words[i:]), i, item_id, name))
+
+        index = {}
+        for scope, entries in groups.items():
+            entries.sort()
+            index[scope] = ([entry[0] for entry in entries], entries)
+        return index, exact
+
+    def _current(self):
+        state = self._state
+        if state is None or time.monotonic() - self._built_at > self.max_age:
+            with self._lock:
+                if self._state is None or time.monotonic() - self._built_at > self.max_age:
+                    self._state = self._build()
+                    self._built_at = time.monotonic()
+                state = self._state
+        return state
+
+    def find(self, field, name, parent_id=0):
+        """Return (id, stored name) of the entry whose normalized name equals `name`, or None."""
+        _, exact = self._current()
+        return exact.get((field, parent_id or 0, normalize(name)))
+
+    def resolve(self, names):
+        """Map {field: name} of parent fields to the id of each level, stopping at the first unknown."""
+        ids = {}
+        parent_id = 0
+        for field in ORDER:
+            if not names.get(field):
+                break
+            match = self.find(field, names[field], parent_id)
+            if not match:
+                break
+            ids[field] = parent_id = match[0]
+        return ids
+
+    def suggest(self, field, prefix, parent_id=0, limit=10):
+        """Return up to `limit` [{'id', 'name'}] under `parent_id` whose name or a word in it starts with `prefix`.
+
+        Matches on the whole name come before matches on a later word.
+        """
+        index, _ = self._current()
+        keys, entries = index.get((field, parent_id or 0), ((), ()))
+        prefix = normalize(prefix)
+        start = bisect_left(keys, prefix)
+
+        matches = {}
+        for position in range(start, len(keys)):
+            if not keys[position].startswith(prefix):
+                break
+            _, word, item_id, name = entries[position]
+            if item_id not in matches or word < matches[item_id][0]:
+                matches[item_id] = (word, name)
+            if len(matches) >= limit * 5:
+                break
+        ranked = sorted(matches.items(), key=lambda item: (item[1][0] > 0, normalize(item[1][1])))
+        return [{'id': item_id, 'name': name} for item_id, (_, name) in ranked[:limit]]
+
+index = TaxonomyIndex()
+# Levels added by other processes show up in this one's index too
+changes.feed.on(changes.TAXONOMY, lambda _: index.invalidate())
+
+def get_or_create(names):
+    """Return the Teacher for {field: name}, reusing entries whose names normalize the same.
+
+    Missing levels are created and flushed and a taxonomy change is
+    logged; the caller commits and then calls index.invalidate().
+    """
+    item = None
+    parent_id = 0
+    created = False
+    for field in ORDER:
+        model, parent = LEVELS[field]
+        name = _SPACES.sub(' ', names[field]).strip()
+        # Below a newly created level there is nothing to match against
+        item = None
+        if not created:
+            match = index.find(field, name, parent_id)
+            if match:
+                item = db.session.get(model, match[0])
+            else:
+                # The index may predate a branch added by another worker
+                item = model.query.filter_by(name=name, **({parent: parent_id} if parent else {})).first()
+        if item is None:
+            item = model(name=name, **({parent: parent_id} if parent else {}))
+            db.session.add(item)
+            db.session.flush()
+            if not created:
+                changes.record(changes.TAXONOMY)
+            created = True
+        parent_id = item.id
+    return item
@@ -0,0 +1,263 @@
+"""One process and one event loop for the admin panel, the Telegram webhook and the bot.
+
+Serve with `python run.py` or `uvicorn asgi:application`. Admin requests
+run the Flask app on a pool of worker threads. Telegram updates arrive
+on the webhook when TELEGRAM_WEBHOOK_URL is set and by long polling
+otherwise. The bot and its background jobs are tasks on the server's
+loop, started and stopped by the ASGI lifespan events. A bot that cannot
+start is retried in the background while the admin panel keeps serving.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from telegram import Update
+from telegram.ext import Application
+from werkzeug.wsgi import FileWrapper
+
+from app import get_app
+from app.admin.bot_client import bot_api_options, get_client
+from app.bot.handlers import TelegramBotHandlers
+from app.bot.ordering import PerChatUpdateProcessor
+from app.utils.analytics import run_rollup_scheduler
+from app.utils.blocklist import blocklist, run_blocklist_refresher
+from app.utils.changes import feed as change_feed, run_change_poller
+from app.utils.digest import run_digest_flusher
+from app.utils.downloads import counters as download_counters, run_download_flusher
+from app.utils.profiling import UpdateProfiler
+from app.utils.rate_limit import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Telegram updates are small; anything larger is not from Telegram
+MAX_UPDATE_BYTES = 1024 * 1024
+
+# Seconds between attempts to start the bot, doubling from the first to the second
+START_RETRY_SECONDS = (5, 300)
+
+# Each chunk of a file response is handed to the event loop separately, so send few large ones
+FILE_CHUNK_BYTES = 256 * 1024
+
+app = get_app()
+
+class _WsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every request on one shared thread; the admin panel gets a pool instead
+    run_wsgi_app = sync_to_async(
+        vars(WsgiToAsgiInstance)['run_wsgi_app'].func,  # the undecorated method
+        thread_sensitive=False,
+        executor=ThreadPoolExecutor(app.config['ADMIN_THREADS'], thread_name_prefix='admin')
+    )
+
+    def build_environ(self, scope, body):
+        environ = super().build_environ(scope, body)
+        environ['wsgi.file_wrapper'] = lambda file, buffer_size=8192: FileWrapper(file, FILE_CHUNK_BYTES)
+        return environ
+
+async def _respond(send, status, body=b''):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(body)).encode('ascii'))]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+class BotRuntime:
+    """The PTB Application and the jobs that run beside it for the life of the server."""
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.webhook_url = flask_app.config['TELEGRAM_WEBHOOK_URL']
+        self.webhook_path = (urlparse(self.webhook_url).path or '/') if self.webhook_url else None
+        # Telegram echoes this in a header on every webhook call
+        self.webhook_secret = hashlib.sha256(
+            b'telegram-webhook:' + flask_app.config['SECRET_KEY'].encode('utf-8')
+        ).hexdigest()
+        self.application = None
+        self.tasks = []
+
+    def _build(self):
+        config = self.app.config
+        builder = Application.builder().token(config['TELEGRAM_TOKEN'])
+        api_options = bot_api_options()
+        if api_options:
+            logger.info(f"Using Bot API server at {api_options['base_url']}")
+            builder = (
+                builder.base_url(api_options['base_url'])
+                .base_file_url(api_options['base_file_url'])
+                .local_mode(api_options['local_mode'])
+            )
+        if self.webhook_url:
+            # Updates are put on the queue by the webhook endpoint instead
+            builder = builder.updater(None)
+        # Every API call shares one outbound budget; menu replies go before bulk sends
+        builder = builder.rate_limiter(get_scheduler())
+        # Handle different chats concurrently while keeping each chat's updates in order
+        # and time every update when slow update profiling is on
+        builder = builder.concurrent_updates(PerChatUpdateProcessor(
+            config['BOT_CONCURRENT_UPDATES'],
+            profiler=UpdateProfiler.from_config(config)
+        ))
+        return builder.build()
+
+    async def start(self):
+        application = self._build()
+
+        # Blocked users are dropped before any handler runs; catalog
+        # changes are counted from here on
+        with self.app.app_context():
+            blocklist.load()
+            change_feed.poll()
+        application.add_handlers(TelegramBotHandlers(self.app).get_handlers())
+
+        logger.info("Starting bot...")
+        # Kept from here on, so stop() can shut down a start that failed part way
+        self.application = application
+        await application.initialize()
+        await application.start()
+
+        if self.webhook_url:
+            logger.info(f"Receiving updates at {self.webhook_url}")
+            await application.bot.set_webhook(
+                url=self.webhook_url,
+                secret_token=self.webhook_secret,
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            logger.info("Starting polling...")
+            await application.updater.start_polling(
+                allowed_updates=Update.ALL_TYPES,
+                timeout=30,
+                read_timeout=30,
+                write_timeout=30,
+                connect_timeout=30,
+                pool_timeout=30
+            )
+
+        # Admin requests send through this bot from their worker threads
+        get_client().attach(asyncio.get_running_loop(), application.bot)
+
+        self.tasks = [asyncio.create_task(job) for job in (
+            # Send coalesced new-note digests
+            run_digest_flusher(self.app, application.bot),
+            # Write buffered download counters to the database
+            run_download_flusher(self.app),
+            # Keep the analytics rollup tables up to date
+            run_rollup_scheduler(self.app),
+            # Pick up blocks and unblocks made by other processes
+            run_blocklist_refresher(self.app),
+            # Drop cached data that other processes' catalog changes made stale
+            run_change_poller(self.app)
+        )]
+
+    async def keep_starting(self):
+        """start(), retried with backoff until it succeeds or the task is cancelled."""
+        delay, longest = START_RETRY_SECONDS
+        while True:
+            try:
+                await self.start()
+                return
+            except Exception as e:
+                logger.error(f"Bot error: {e}")
+                if "certificate verify failed" in str(e):
+                    logger.error("SSL Certificate verification failed. Check your SSL certificates.")
+                elif "All connection attempts failed" in str(e):
+                    logger.error("Could not connect to Telegram. Check your internet connection.")
+                await self.stop()
+            logger.info(f"Retrying bot start in {delay} seconds")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, longest)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        get_client().detach()
+
+        try:
+            with self.app.app_context():
+                download_counters.flush()
+        except Exception as e:
+            logger.error(f"Error flushing download counters: {e}")
+
+        application, self.application = self.application, None
+        if application is None:
+            return
+        try:
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+        except Exception as e:
+            logger.error(f"Error during shutdown: {e}")
+
+    async def handle_webhook(self, scope, receive, send):
+        """Queue one update pushed by Telegram."""
+        headers = dict(scope['headers'])
+        secret = headers.get(b'x-telegram-bot-api-secret-token', b'')
+        if not hmac.compare_digest(secret, self.webhook_secret.encode('ascii')):
+            await _respond(send, 403)
+            return
+        if self.application is None or not self.application.running:
+            # Still starting; Telegram retries the update later
+            await _respond(send, 503)
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > MAX_UPDATE_BYTES:
+                await _respond(send, 413)
+                return
+            if not message.get('more_body'):
+                break
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Ignoring malformed webhook body: {e}")
+            await _respond(send, 400)
+            return
+        await self.application.update_queue.put(update)
+        await _respond(send, 200)
+
+class Server:
+    """ASGI application routing the webhook to the bot and everything else to Flask."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.bot = BotRuntime(flask_app)
+        self.bot_starter = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == self.bot.webhook_path:
+            await self.bot.handle_webhook(scope, receive, send)
+        else:
+            await _WsgiInstance(self.flask_app)(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # The admin panel serves at once, even while Telegram is unreachable
+                self.bot_starter = asyncio.create_task(self.bot.keep_starting())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.bot_starter:
+                    self.bot_starter.cancel()
+                    await asyncio.gather(self.bot_starter, return_exceptions=True)
+                await self.bot.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+application = Server(app)
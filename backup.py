@@ -0,0 +1,30 @@
+"""Export or restore a backup of the database and uploaded notes.
+
+Usage:
+    python backup.py export <archive.tar.gz> [--incremental]
+    python backup.py restore <full.tar.gz> [<incremental.tar.gz> ...]
+"""
+import sys
+from app import create_app
+from app.utils.backup import export_backup, restore_backup
+
+def main(argv):
+    if len(argv) < 2 or argv[0] not in ('export', 'restore'):
+        print(__doc__)
+        return 1
+
+    app = create_app()
+    with app.app_context():
+        if argv[0] == 'export':
+            incremental = '--incremental' in argv
+            with open(argv[1], 'wb') as out:
+                manifest = export_backup(out, incremental=incremental)
+            print(f"Backup written to {argv[1]} ({len(manifest['included'])} files)")
+        else:
+            for path in argv[1:]:
+                manifest = restore_backup(path)
+                print(f"Restored {path} from {manifest['created_at'] if manifest else 'unknown date'}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,64 @@
+"""Fail when the cold-start import time of the admin tier exceeds its budget.
+
+Usage: python check_startup.py [module] [budget_ms]
+"""
+import os
+import re
+import subprocess
+import sys
+
+# Cumulative import time allowed for the entry module, in milliseconds
+DEFAULT_BUDGET_MS = int(os.environ.get('STARTUP_IMPORT_BUDGET_MS', 1200))
+
+# Modules that must not be imported while serving the admin panel
+FORBIDDEN_MODULES = ('telegram', 'nest_asyncio')
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+def measure_imports(module):
+    """Import `module` in a fresh interpreter and return {name: cumulative_us}."""
+    env = dict(os.environ)
+    env.setdefault('TELEGRAM_TOKEN', 'startup-check')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            timings[match.group(4)] = int(match.group(2))
+    return timings
+
+def check_startup(module='wsgi', budget_ms=DEFAULT_BUDGET_MS):
+    """Return a list of budget violations for a cold import of `module`."""
+    timings = measure_imports(module)
+    errors = []
+
+    total_ms = timings.get(module, 0) / 1000
+    print(f"Cold import of {module}: {total_ms:.0f}ms (budget {budget_ms}ms)")
+    if total_ms > budget_ms:
+        errors.append(f"{module} took {total_ms:.0f}ms to import, budget is {budget_ms}ms")
+
+    for name in FORBIDDEN_MODULES:
+        if name in timings:
+            errors.append(f"{name} is imported at startup ({timings[name] / 1000:.0f}ms)")
+
+    slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[:10]
+    for name, cumulative in slowest:
+        print(f"  {cumulative / 1000:8.1f}ms  {name}")
+    return errors
+
+if __name__ == '__main__':
+    module = sys.argv[1] if len(sys.argv) > 1 else 'wsgi'
+    budget = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BUDGET_MS
+    errors = check_startup(module, budget)
+    for error in errors:
+        print(f"FAIL: {error}")
+    sys.exit(1 if errors else 0)
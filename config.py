@@ -16,9 +16,106 @@ class Config:
     if not TELEGRAM_TOKEN:
         raise ValueError("TELEGRAM_TOKEN environment variable is not set!")
     
+    # Bot API server configuration; point at a self-hosted telegram-bot-api for large files
+    TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL')  # e.g. http://localhost:8081/bot
+    TELEGRAM_API_FILE_URL = os.environ.get('TELEGRAM_API_FILE_URL') or (
+        TELEGRAM_API_URL and TELEGRAM_API_URL.rsplit('/bot', 1)[0] + '/file/bot'
+    )
+    # Local mode sends file paths instead of bytes; the server must see the upload folder
+    TELEGRAM_LOCAL_MODE = os.environ.get('TELEGRAM_LOCAL_MODE', '1' if TELEGRAM_API_URL else '0') == '1'
+    TELEGRAM_MAX_FILE_MB = int(os.environ.get('TELEGRAM_MAX_FILE_MB', 2000 if TELEGRAM_API_URL else 50))
+    TELEGRAM_POOL_SIZE = int(os.environ.get('TELEGRAM_POOL_SIZE', 32))  # admin client connections for fan-out
+    
+    # Updates are pushed to this URL when set (its path is served by asgi.py); otherwise the bot polls
+    TELEGRAM_WEBHOOK_URL = os.environ.get('TELEGRAM_WEBHOOK_URL')  # e.g. https://notes.example.com/webhook
+    
+    # Server configuration for asgi.py, which hosts the admin panel and the bot in one process
+    SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+    SERVER_PORT = int(os.environ.get('SERVER_PORT', 5000))
+    ADMIN_THREADS = int(os.environ.get('ADMIN_THREADS', 8))  # admin panel requests handled at once
+    
+    # Outbound rate limits shared by bot replies, notifications and broadcasts
+    TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', 30))  # messages per second
+    TELEGRAM_CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', 1))  # per private chat per second
+    TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.environ.get('TELEGRAM_GROUP_RATE_PER_MINUTE', 20))
+    TELEGRAM_INTERACTIVE_RESERVE = int(os.environ.get('TELEGRAM_INTERACTIVE_RESERVE', 5))  # tokens bulk sends leave free
+    
+    # Broadcast configuration
+    BROADCAST_BATCH_SIZE = int(os.environ.get('BROADCAST_BATCH_SIZE', 500))
+    BROADCAST_PROGRESS_SECONDS = float(os.environ.get('BROADCAST_PROGRESS_SECONDS', 2))  # progress is saved this often
+    BROADCAST_STALE_MINUTES = int(os.environ.get('BROADCAST_STALE_MINUTES', 10))  # silent this long, a job is resumed
+    
+    # Notification digest configuration
+    DIGEST_WINDOW_MINUTES = int(os.environ.get('DIGEST_WINDOW_MINUTES', 30))
+    DIGEST_CHECK_INTERVAL = int(os.environ.get('DIGEST_CHECK_INTERVAL', 60))  # seconds
+    
+    # Flood control configuration
+    FLOOD_RATE = float(os.environ.get('FLOOD_RATE', 1))  # tokens per second per user
+    FLOOD_BURST = int(os.environ.get('FLOOD_BURST', 5))
+    FLOOD_IDLE_SECONDS = int(os.environ.get('FLOOD_IDLE_SECONDS', 600))
+    FLOOD_MAX_USERS = int(os.environ.get('FLOOD_MAX_USERS', 100000))
+    
+    # Blocked users are dropped from memory; other processes' blocks are picked up this often
+    BLOCKLIST_REFRESH_SECONDS = int(os.environ.get('BLOCKLIST_REFRESH_SECONDS', 5))
+    
+    # Catalog changes made by other processes reach in-memory caches within this many seconds
+    CHANGE_POLL_SECONDS = float(os.environ.get('CHANGE_POLL_SECONDS', 2))
+    CHANGE_LOG_RETENTION_DAYS = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', 7))
+    
+    # Update processing configuration; updates from one chat are still handled in order
+    BOT_CONCURRENT_UPDATES = int(os.environ.get('BOT_CONCURRENT_UPDATES', 32))
+    
+    # Slow update profiling; off unless PROFILE_UPDATES=1
+    PROFILE_UPDATES = os.environ.get('PROFILE_UPDATES', '0') == '1'
+    PROFILE_SLOW_MS = int(os.environ.get('PROFILE_SLOW_MS', 1000))  # updates slower than this are dumped
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # fraction of all updates also dumped
+    PROFILE_SAMPLE_AFTER_MS = int(os.environ.get('PROFILE_SAMPLE_AFTER_MS', 100))  # stack sampling starts here
+    PROFILE_INTERVAL_MS = int(os.environ.get('PROFILE_INTERVAL_MS', 5))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+    
+    # Bot listing configuration
+    BOT_PAGE_SIZE = int(os.environ.get('BOT_PAGE_SIZE', 10))  # buttons per page
+    BOT_NOTES_PAGE_SIZE = int(os.environ.get('BOT_NOTES_PAGE_SIZE', 8))  # notes per message
+    
+    # Download statistics configuration
+    DOWNLOAD_FLUSH_INTERVAL = int(os.environ.get('DOWNLOAD_FLUSH_INTERVAL', 60))  # seconds
+    TOP_DOWNLOADS_CACHE_SECONDS = int(os.environ.get('TOP_DOWNLOADS_CACHE_SECONDS', 300))
+    
+    # Note ranking configuration
+    RANKING_PRIOR_MEAN = float(os.environ.get('RANKING_PRIOR_MEAN', 3.0))
+    RANKING_PRIOR_WEIGHT = float(os.environ.get('RANKING_PRIOR_WEIGHT', 10))  # votes
+    RANKING_HALF_LIFE_HOURS = float(os.environ.get('RANKING_HALF_LIFE_HOURS', 72))
+    
+    # Analytics configuration
+    ANALYTICS_ROLLUP_INTERVAL = int(os.environ.get('ANALYTICS_ROLLUP_INTERVAL', 900))  # seconds
+    
+    # PDF optimization configuration; needs the optional pikepdf package
+    PDF_OPTIMIZE = os.environ.get('PDF_OPTIMIZE', '1') == '1'
+    PDF_OPTIMIZE_WORKERS = int(os.environ.get('PDF_OPTIMIZE_WORKERS', 1))
+    PDF_IMAGE_MAX_DIMENSION = int(os.environ.get('PDF_IMAGE_MAX_DIMENSION', 2000))  # pixels
+    PDF_IMAGE_QUALITY = int(os.environ.get('PDF_IMAGE_QUALITY', 75))  # JPEG quality
+    PDF_OPTIMIZE_MIN_SAVING = float(os.environ.get('PDF_OPTIMIZE_MIN_SAVING', 0.1))  # fraction of original size
+    
+    # PDF full-text indexing configuration; needs the optional pypdf package
+    PDF_TEXT_INDEX = os.environ.get('PDF_TEXT_INDEX', '1') == '1'
+    PDF_TEXT_WORKERS = int(os.environ.get('PDF_TEXT_WORKERS', 1))  # 0 uses every core
+    SEARCH_RESULTS = int(os.environ.get('SEARCH_RESULTS', 8))  # notes per search reply
+    
+    # Per-lesson ZIP bundles; rebuilt on the next request after the lesson's notes change
+    BUNDLE_FOLDER = os.environ.get('BUNDLE_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bundles')
+    
+    # Admin note previews; behind nginx, name an internal location aliased to UPLOAD_FOLDER to hand files to it
+    NOTE_ACCEL_PREFIX = os.environ.get('NOTE_ACCEL_PREFIX')  # e.g. /protected-uploads/
+    
+    # Resumable upload configuration
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))  # must stay below MAX_CONTENT_LENGTH
+    UPLOAD_PARTIAL_EXPIRY_HOURS = int(os.environ.get('UPLOAD_PARTIAL_EXPIRY_HOURS', 24))
+    
     # File upload configuration
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    BACKUP_FOLDER = os.environ.get('BACKUP_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
     ALLOWED_EXTENSIONS = {'pdf'}
     
     # Session configuration
@@ -0,0 +1,33 @@
+"""Extract and index the text of notes whose PDFs have not been indexed yet.
+
+Runs on every core by default and commits each note as it finishes, so an
+interrupted run can simply be started again.
+
+Usage:
+    python index_text.py [--workers N] [--reindex]
+"""
+import sys
+from app import create_app, db
+from app.models.database import Note, NotePage
+from app.utils.fulltext import backfill
+
+def main(argv):
+    if '-h' in argv or '--help' in argv:
+        print(__doc__)
+        return 0
+    workers = int(argv[argv.index('--workers') + 1]) if '--workers' in argv else None
+
+    app = create_app()
+    with app.app_context():
+        if '--reindex' in argv:
+            NotePage.query.delete()
+            Note.query.update({Note.text_pages: None})
+            db.session.commit()
+        pending = Note.query.filter(Note.text_pages.is_(None)).count()
+        print(f"Indexing {pending} notes...")
+        indexed = backfill(workers, progress=lambda note_id, done: print(f"  note {note_id} ({done}/{pending})"))
+        print(f"Indexed {indexed} notes")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
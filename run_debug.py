@@ -1,7 +1,7 @@
 from flask import Flask
-from app import create_app
+from app import get_app
 
-app = create_app()
+app = get_app()
 
 if __name__ == '__main__':
     print("Registered URLs:")
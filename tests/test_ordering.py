@@ -0,0 +1,168 @@
+"""PerChatUpdateProcessor overrides PTB's final process_update; these tests pin the behaviour it relies on."""
+import asyncio
+import random
+import warnings
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import Application, ConversationHandler, ExtBot, MessageHandler, filters
+
+from app.bot.ordering import PerChatUpdateProcessor
+
+CHATS = 6
+UPDATES_PER_CHAT = 40
+
+class OfflineBot(ExtBot):
+    # initialize() calls getMe; answer it without the network
+    async def get_me(self, *args, **kwargs):
+        self._bot_user = User(1, 'Test', True, username='test_bot')
+        return self._bot_user
+
+def _update(update_id, chat_id, text='next'):
+    user = User(chat_id, f'user{chat_id}', False)
+    message = Message(update_id, datetime.now(), Chat(chat_id, Chat.PRIVATE), from_user=user, text=text)
+    return Update(update_id, message=message)
+
+def _interleaved():
+    """UPDATES_PER_CHAT updates for each of CHATS chats, shuffled across chats but in order within each."""
+    rng = random.Random(39)
+    pending = {chat_id: 0 for chat_id in range(1, CHATS + 1)}
+    updates = []
+    while pending:
+        chat_id = rng.choice(sorted(pending))
+        updates.append((chat_id, pending[chat_id]))
+        pending[chat_id] += 1
+        if pending[chat_id] == UPDATES_PER_CHAT:
+            del pending[chat_id]
+    return updates
+
+def test_each_chat_in_order_and_nothing_dropped():
+    async def scenario():
+        processor = PerChatUpdateProcessor(4)
+        handled = {chat_id: [] for chat_id in range(1, CHATS + 1)}
+        in_flight = {chat_id: 0 for chat_id in handled}
+        rng = random.Random(1)
+
+        async def handle(chat_id, seq):
+            in_flight[chat_id] += 1
+            assert in_flight[chat_id] == 1, 'two updates of one chat ran at once'
+            await asyncio.sleep(rng.random() / 500)
+            handled[chat_id].append(seq)
+            in_flight[chat_id] -= 1
+
+        # Dispatched the way Application's fetcher does: each update as its own task
+        await asyncio.gather(*(
+            processor.process_update(_update(index, chat_id), handle(chat_id, seq))
+            for index, (chat_id, seq) in enumerate(_interleaved())
+        ))
+        return handled, processor
+
+    handled, processor = asyncio.run(scenario())
+    for chat_id, seqs in handled.items():
+        assert seqs == list(range(UPDATES_PER_CHAT)), f'chat {chat_id} saw {seqs}'
+    # Per-chat locks are dropped once a chat has nothing in flight
+    assert processor._chats == {}
+
+def test_different_chats_run_concurrently():
+    async def scenario():
+        processor = PerChatUpdateProcessor(4)
+        first_started = asyncio.Event()
+        second_started = asyncio.Event()
+
+        async def first():
+            first_started.set()
+            # Only finishes if the other chat's update runs while this one waits
+            await asyncio.wait_for(second_started.wait(), 1)
+
+        async def second():
+            second_started.set()
+            await asyncio.wait_for(first_started.wait(), 1)
+
+        await asyncio.gather(
+            processor.process_update(_update(1, 1), first()),
+            processor.process_update(_update(2, 2), second())
+        )
+
+    asyncio.run(scenario())
+
+def test_chat_waiting_on_itself_does_not_hold_a_slot():
+    async def scenario():
+        processor = PerChatUpdateProcessor(2)
+        release = asyncio.Event()
+        order = []
+
+        async def slow():
+            order.append('slow')
+            await release.wait()
+
+        async def queued():
+            order.append('queued')
+
+        async def other():
+            order.append('other')
+            release.set()
+
+        # The second update of chat 1 waits for its chat, leaving the other slot to chat 2
+        await asyncio.wait_for(asyncio.gather(
+            processor.process_update(_update(1, 1), slow()),
+            processor.process_update(_update(2, 1), queued()),
+            processor.process_update(_update(3, 2), other())
+        ), 1)
+        return order
+
+    assert asyncio.run(scenario()) == ['slow', 'other', 'queued']
+
+def test_no_lost_conversation_transitions_under_load():
+    async def scenario():
+        steps = 8
+        rng = random.Random(7)
+        reached = {}
+
+        def advance(state):
+            async def callback(update, context):
+                # Yield mid-handler so a concurrent update of the same chat would read a stale state
+                await asyncio.sleep(rng.random() / 500)
+                reached.setdefault(update.effective_chat.id, []).append(state)
+                return state + 1 if state + 1 < steps else ConversationHandler.END
+            return callback
+
+        with warnings.catch_warnings():
+            # PTB warns that ConversationHandler is unsafe with concurrent updates; that is what is tested
+            warnings.simplefilter('ignore')
+            conversation = ConversationHandler(
+                entry_points=[MessageHandler(filters.TEXT, advance(0))],
+                states={state: [MessageHandler(filters.TEXT, advance(state))] for state in range(1, steps)},
+                fallbacks=[]
+            )
+            application = (
+                Application.builder()
+                .bot(OfflineBot('123456:test-token'))
+                .updater(None)
+                .concurrent_updates(PerChatUpdateProcessor(4))
+                .build()
+            )
+        application.add_handler(conversation)
+
+        await application.initialize()
+        await application.start()
+        try:
+            rounds = _interleaved()
+            for index, (chat_id, seq) in enumerate(rounds):
+                if seq < steps:
+                    await application.update_queue.put(_update(index, chat_id))
+            expected = CHATS * steps
+            for _ in range(500):
+                if sum(len(states) for states in reached.values()) >= expected:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await application.stop()
+            await application.shutdown()
+        return reached, steps, conversation
+
+    reached, steps, conversation = asyncio.run(scenario())
+    assert sorted(reached) == list(range(1, CHATS + 1))
+    for chat_id, states in reached.items():
+        assert states == list(range(steps)), f'chat {chat_id} went through {states}'
+    # Every conversation ran to END, so none is left part way
+    assert not conversation._conversations
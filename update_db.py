@@ -1,7 +1,9 @@
 from app import create_app, db
 from app.models.database import Note, Rating, User
+from app.utils import ranking
 from datetime import datetime
-from sqlalchemy import text
+from sqlalchemy import text, inspect
+import sys
 
 def update_database():
     app = create_app()
@@ -20,5 +22,31 @@ def update_database():
             print(f"Error during database update: {e}")
             db.session.rollback()
 
+def upgrade_database():
+    """Create new tables and add new columns without dropping existing data."""
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        inspector = inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                print(f"Added column {table.name}.{column.name}")
+        db.session.commit()
+        # Replaced by ix_note_teacher_rank, which sorts unscored notes too
+        db.session.execute(text('DROP INDEX IF EXISTS ix_note_teacher_bayesian'))
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+        ranking.recompute_all()
+        print("Database upgrade completed successfully!")
+
 if __name__ == "__main__":
-    update_database() 
\ No newline at end of file
+    if '--upgrade' in sys.argv:
+        upgrade_database()
+    else:
+        update_database() 
\ No newline at end of file
@@ -1,7 +1,7 @@
-from app import create_app
+from app import get_app
 
 # Create the Flask application
-application = create_app()
+application = get_app()
 
 # For local development
 if __name__ == "__main__":